@@ -45,7 +45,6 @@ class SkillAfterQuery(aq.BaseAfterQuery):
         
         skill_type = list(parsed_answer[-1].keys())[0]
         skill_desc, skill_param, skill_guide = parsed_answer[-1][skill_type]
-        self.node.result_raw = self.node.result
         self.node.result = "[{},{},{}]".format(skill_type, skill_desc, skill_param, skill_guide)
         self.node.db['skills']['skill_library'][skill_type] = {
                 'skill_desc': skill_desc,
@@ -97,7 +96,6 @@ class KBAddAfterQuery(aq.JsonAfterQuery):
                     new_knowledge[k] = v['discovery_short']
         except Exception as e:
             raise ex.AfterQueryError("Invalid answer", "{}: {}".format(e, traceback.format_exc()))
-        self.node.result_raw = self.node.result
         self.node.result = json.dumps(json_dict, sort_keys=True, indent=0)
         self.node.db['kb']['knowledge_base'].update(new_knowledge)
 
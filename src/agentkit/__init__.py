@@ -1,7 +1,17 @@
-from .graph import Graph
+from .graph import Graph, History
+from .context import ExecutionContext
 from .base_node import BaseNode
+from .batch import GraphBatch
+from .timeline import Timeline
+from .hooks import Hooks
+from .workers import WorkerPool
+from .pipeline import Pipeline
+from .database import Database, DatabaseConflict
+from .fusion import fuse_nodes, unfuse_nodes
+from .novelty import NoveltyDetector
 from .node import *
-from .exceptions import AfterQueryError
+from .exceptions import AfterQueryError, LLMQueryError
 from . import compose_prompt
 from . import after_query
-from . import utils
\ No newline at end of file
+from . import utils
+from . import schedule
\ No newline at end of file
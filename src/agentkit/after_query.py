@@ -28,6 +28,7 @@ class BaseAfterQuery:
         """Post process the result of the LLM query.
         
         This method can be overridden by the derived class to perform postprocessing.
+        It may also be a coroutine, in which case it is awaited when the node is evaluated with aevaluate().
         """
         pass
 
@@ -35,7 +36,7 @@ class BaseAfterQuery:
         if self.node is None:
             raise Exception("Node is not set")
 
-        self.post_process()
+        return self.post_process()
 
 class JsonAfterQuery(BaseAfterQuery):
     """Class for after query postprocessing of Json objects.
@@ -1,16 +1,29 @@
-from .exceptions import AfterQueryError
-from .node_functions import error_msg_default
+from .exceptions import AfterQueryError, LLMQueryError
+from .node_functions import error_msg_default, is_async_callable, call_in_thread, call_in_executor, ThreadCall
+from .node_list import NodeList
+from .context import RunState, RunValues, run_state, same_value
 from collections.abc import Callable, Awaitable
 from .graph import Graph
 from .after_query import BaseAfterQuery
 from .compose_prompt import BaseComposePrompt
 from colorama import Fore, Back, Style
+from collections import namedtuple
+import asyncio
+import concurrent.futures
 import copy
 import datetime
-try:
-    from wandb.sdk.data_types.trace_tree import Trace
-except:
-    pass
+import hashlib
+import inspect
+import json
+
+LLMRequest = namedtuple("LLMRequest", ["prompt", "shrink_idx"])
+
+def _abandon(call):
+    # stop waiting for an LLM query: the worker of a WorkerPool query is replaced, a call_in_executor() call is told to stop
+    if isinstance(call, ThreadCall):
+        call.abandon()
+    else:
+        call.cancel()
 
 class BaseNode:
     """Base class for a node in the graph.
@@ -21,12 +34,25 @@ class BaseNode:
         key (str): Unique key for the node.
         prompt (str): Prompt for the node.
         result (str): Result of the node evaluation.
+        default_result (str): Result used when the node is degraded (see Graph.evaluate(deadline=...)) before it has ever been evaluated.
         temporary_skip (bool): Flag to skip the node evaluation.
         graph (Graph): Graph object.
-        adjacent_to (list): List of nodes that are adjacent to this node.
-        adjacent_from (list): List of nodes that are adjacent from this node.
-        evaluate_after (list): List of nodes that are evaluated after this node.
+        adjacent_to (NodeList): Nodes that are adjacent to this node.
+        adjacent_from (NodeList): Nodes that are adjacent from this node.
+        evaluate_after (NodeList): Nodes that are evaluated after this node.
+        evaluate_before (NodeList): Nodes that are ordered after this node (reverse of evaluate_after).
         counts (list): List of token counts.
+        latency (float): Exponentially weighted moving average of the LLM time (in seconds) spent per evaluation. None if the node has never been evaluated.
+        latency_alpha (float): Smoothing factor of the latency estimate.
+        reused (bool): Whether the last evaluation reused the previous result (see Graph.evaluate(incremental=True)).
+        timeout (float): Time limit in seconds of a single LLM query. A query that exceeds it, or the deadline of the evaluation (see Graph.evaluate()), is abandoned and counts as a failed attempt. None (default) waits forever.
+        max_attempts (int): Number of attempts of each LLM query before the node fails with an LLMQueryError. A failed node falls back to its previous result or its default_result, and is listed in History.failed (the LLMQueryError is raised if it has neither). Only nodes with a timeout or more than one attempt fail this way: by default, an exception of query_llm is raised as is.
+        stale_while_revalidate (bool): Serve the last result immediately and refresh it in the background. Once the node has a result, it does not hold up its dependents: its last result is reported (and listed in History.stale) while its prompt, composed from the current inputs, is sent to the LLM in the background. The refreshed result and the side effects of its AfterQuery (which must be synchronous and must not modify the graph) are applied at the beginning of the first evaluation after the answer arrived. GraphBatch evaluates the node as usual.
+        deferred (bool): Let the evaluation of the graph return before the node completes, e.g. for reflection or bookkeeping nodes whose results are not needed by the caller. The node keeps running in the background (on the event loop for Graph.aevaluate(), which must keep running) and is listed in History.deferred until it completes. The next evaluation (or Graph.join()) waits for it. A node that a non-deferred node depends on is waited for anyway.
+        condition (Callable): Function of the node (e.g. of node.db and of the results of its dependencies) that tells whether the node needs to query the LLM in this evaluation. It is checked when the node becomes ready. If it is false, the node reports its gated_result and is listed in History.gated. None (default) always queries the LLM.
+        gated_result (str): Result reported when the condition of the node is false. None (default) reports its previous result.
+        schedule (Schedule): When the node is evaluated (see agentkit.schedule), e.g. Every(25). At other iterations, its cached result is reused. None (default) evaluates it at every iteration.
+        fusion (FusionGroup): Group of sibling nodes whose LLM queries are sent as a single request, or None (see agentkit.fusion.fuse_nodes()).
         query_llm (Callable): Function to query the LLM.
         _compose_prompt (BaseComposePrompt): ComposePrompt object.
         after_query (BaseAfterQuery): AfterQuery object.
@@ -34,7 +60,28 @@ class BaseNode:
         verbose (bool): Verbose flag. Node will print the prompt and answer.
         markdown (bool): Markdown flag. Enables markdown output.
         token_counter (Callable): Function to count tokens.
+        subscribers (list): Hooks objects notified of the events of this node only (see Graph.subscribe()).
     """
+    __slots__ = ("_own_state", "key", "prompt", "default_result", "counts", "latency", "latency_alpha",
+                 "timeout", "max_attempts", "stale_while_revalidate", "deferred", "fusion", "condition", "gated_result", "schedule", "query_llm", "_compose_prompt",
+                 "after_query", "subscribers", "verbose", "markdown", "_add_error_msg", "token_counter")
+
+    # state of the evaluations, kept by the current ExecutionContext (see agentkit.context)
+    result = RunState()
+    temporary_skip = RunState(default=False)
+    graph = RunState(inherit=same_value)
+    adjacent_to = RunState(factory=NodeList, inherit=lambda context, nodes: NodeList(nodes))
+    adjacent_from = RunState(factory=NodeList, inherit=lambda context, nodes: NodeList(nodes))
+    evaluate_after = RunState(factory=NodeList, inherit=lambda context, nodes: NodeList(nodes))
+    evaluate_before = RunState(factory=NodeList, inherit=lambda context, nodes: NodeList(nodes))
+    reused = RunState(default=False)
+    _input_hash = RunState()
+    _raw_result = RunState()
+    _llm_time = RunState(default=0.)
+    _refresh = RunState()
+    _fused = RunState()
+    _schedule_values = RunState(factory=dict)
+
     def __init__(self, key:str, prompt:str, graph:Graph, query_llm:Callable, compose_prompt:BaseComposePrompt, after_query:BaseAfterQuery=None, error_msg_fn:Callable[[list,str,AfterQueryError],list]=error_msg_default, verbose:bool=False, token_counter:Callable=None):
         """Initializes the BaseNode class.
         
@@ -49,20 +96,37 @@ class BaseNode:
             verbose (bool): Verbose flag.
             token_counter (Callable): Function to count tokens.
         """
+        self._own_state = RunValues(type(self))
         self.key = key
         self.prompt = prompt
         self.result = None
-        self.temporary_skip = False
+        self.default_result = None
         self.temporary_skip = False
         self.graph = graph
-        self.adjacent_to = []  # this -> node
-        self.adjacent_from = []  # node -> this
-        self.evaluate_after = []  # node -> this
+        self.adjacent_to = NodeList()  # this -> node
+        self.adjacent_from = NodeList()  # node -> this
+        self.evaluate_after = NodeList()  # node -> this
+        self.evaluate_before = NodeList()  # this -> node
         self.counts = []
+        self.latency = None
+        self.reused = False
+        self._input_hash = None
+        self._raw_result = None
+        self.latency_alpha = 0.3
+        self._llm_time = 0.
+        self.timeout = None
+        self.max_attempts = 1
+        self.stale_while_revalidate = False
+        self.deferred = False
+        self.fusion = None
+        self.condition = None
+        self.gated_result = None
+        self.schedule = None
+        self._refresh = None
         self.query_llm = query_llm
         self._compose_prompt = compose_prompt
         self.after_query = None
-        self.chain_span = None
+        self.subscribers = []
         if after_query is not None:
             self.after_query = after_query
             self.after_query.set_node(self)
@@ -124,120 +188,370 @@ class BaseNode:
         assert self.result is not None, "Attempting to skip a node ({}) that has never been evaluated".format(self.key)
         self.temporary_skip = True
     
-    def _query_llm(self, prompt, shrink_idx):
+    def subscribe(self, subscriber):
+        """Subscribe to the events of this node.
 
-        start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
-        result = self.query_llm(prompt, shrink_idx)
-        end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+        Args:
+            subscriber (Hooks): The subscriber.
+        """
+        self.subscribers.append(subscriber)
 
-        if self.chain_span is not None:
-            llm_span = Trace(
-                "OpenAI",
-                kind="llm",
-                start_time_ms=start_time_ms,
-                end_time_ms=end_time_ms,
-                inputs={"prompt":prompt},
-                status_code="success",
-                outputs={"response": result},
-            )
-            self.chain_span.add_child(llm_span)
-        return result
-    
-    def _after_query(self, ignore_errors=False):
-        if self.after_query is None:
-            return
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber.
+
+        Args:
+            subscriber (Hooks): The subscriber.
+        """
+        self.subscribers.remove(subscriber)
+
+    def _emit(self, event, *args):
+        for subscriber in self.graph.subscribers:
+            getattr(subscriber, event)(*args)
+        for subscriber in self.subscribers:
+            getattr(subscriber, event)(*args)
+
+    def _record_llm_call(self, prompt, result, start_time_ms, end_time_ms):
+        self._llm_time += (end_time_ms - start_time_ms) / 1000
+        self._emit("on_llm_response", self, prompt, result, start_time_ms, end_time_ms)
+
+    def _query_failed(self, errors):
+        return LLMQueryError("Node {} failed to query the LLM after {} attempt(s): {!r}".format(self.key, len(errors), errors[-1]), self.key, errors)
+
+    def _falls_back(self):
+        # errors of query_llm only make the node fail with an LLMQueryError (and fall back) if it opted in with a timeout or several attempts
+        return self.timeout is not None or self.max_attempts > 1
+
+    def _query_timeout(self):
+        # the wait for a query is limited by the timeout of the node and by the deadline of the evaluation
+        time_left = self.graph._time_left()
+        if time_left is None or (self.timeout is not None and self.timeout <= time_left):
+            return self.timeout
+        return time_left
+
+    def _query_llm(self, prompt, shrink_idx, timeline=None):
+        # background queries (refreshes) are given the timeline of the evaluation that sent them, and are not limited by its deadline
+        graph = self.graph
+        background = timeline is not None
+        timeline = graph.timeline if timeline is None else timeline
+        errors = []
+        for _ in range(self.max_attempts):
+            timeout = self.timeout if background else self._query_timeout()
+            if timeout is not None and timeout <= 0:
+                errors.append(TimeoutError("The deadline of the evaluation passed"))
+                break
+            if len(errors) > 0:
+                timeline.record(self.key, "retry")
+            start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            timeline.record(self.key, "llm_send")
+            self._emit("on_llm_request", self, prompt)
+            call = None
+            try:
+                worker_pool = graph.worker_pool
+                if worker_pool is not None:
+                    call = worker_pool.submit(self.query_llm, prompt, shrink_idx)
+                    result = call.result(timeout=timeout)
+                elif timeout is None:
+                    result = self.query_llm(prompt, shrink_idx)
+                else: # a hung call is abandoned in its thread, with its own copy of the prompt
+                    call = call_in_executor(self.query_llm, copy.deepcopy(prompt), shrink_idx, timeout=timeout)
+                    result = call.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                errors.append(TimeoutError("LLM query timed out after {} seconds".format(round(timeout, 3))))
+                continue
+            except Exception as e:
+                if not self._falls_back():
+                    raise
+                errors.append(e)
+                continue
+            finally:
+                if call is not None and not call.done():
+                    _abandon(call)
+                timeline.record(self.key, "llm_return")
+            end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            self._record_llm_call(prompt, result, start_time_ms, end_time_ms)
+            return result
+        raise self._query_failed(errors)
+
+    async def _aquery_llm(self, prompt, shrink_idx, executor=None):
+        errors = []
+        for _ in range(self.max_attempts):
+            if len(errors) > 0:
+                self.graph.timeline.record(self.key, "retry")
+            start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            self.graph.timeline.record(self.key, "llm_send")
+            self._emit("on_llm_request", self, prompt)
+            thread_call = None
+            if self.graph.worker_pool is not None: # cancelled on timeout
+                call = asyncio.wrap_future(self.graph.worker_pool.submit(self.query_llm, prompt, shrink_idx))
+            elif is_async_callable(self.query_llm): # cancelled on timeout
+                call = self.query_llm(prompt, shrink_idx)
+            elif self.timeout is None:
+                call = asyncio.get_running_loop().run_in_executor(executor, self.query_llm, prompt, shrink_idx)
+            else: # a hung call is told to stop (see _query_llm)
+                thread_call = call_in_executor(self.query_llm, copy.deepcopy(prompt), shrink_idx, executor=executor, timeout=self.timeout)
+                call = asyncio.wrap_future(thread_call)
+            try:
+                result = await asyncio.wait_for(call, self.timeout)
+            except asyncio.TimeoutError:
+                errors.append(TimeoutError("LLM query timed out after {} seconds".format(self.timeout)))
+                continue
+            except Exception as e:
+                if not self._falls_back():
+                    raise
+                errors.append(e)
+                continue
+            finally:
+                if thread_call is not None and not thread_call.done():
+                    thread_call.abandon()
+                self.graph.timeline.record(self.key, "llm_return")
+            end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            self._record_llm_call(prompt, result, start_time_ms, end_time_ms)
+            return result
+        raise self._query_failed(errors)
+
+    def _finish_after_query(self, after_query_input, start_time_ms, error, ignore_errors):
+        self.graph.timeline.record(self.key, "after_query_end")
         status_code = "success"
         status_message = ""
-        error = None
-        after_query_input = self.result
-        try:
-            start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
-            self.after_query()
-        except AfterQueryError as e:
+        if error is not None:
             status_code = "error"
-            status_message = e.error
-            error = e
+            status_message = error.error
             self.result = after_query_input
         end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
-        if self.chain_span is not None:
-            tool_span = Trace(
-                "AfterQuery",
-                kind="tool",
-                status_code=status_code,
-                status_message=status_message,
-                start_time_ms=start_time_ms,
-                end_time_ms=end_time_ms,
-                inputs={"input": after_query_input},
-                outputs={"response": self.result},
-            )
-            self.chain_span.add_child(tool_span)
+        self._emit("on_after_query", self, after_query_input, error, start_time_ms, end_time_ms)
         if status_code == "error":
             if ignore_errors:
                 print(Fore.RED + "WARNING: ({}, {}) for {}".format(error, status_message, self.result) + Fore.RESET)
                 self.result = "N/A"
             else:
                 raise error
+        return status_code == "success"
+
+    def _after_query(self, ignore_errors=False):
+        """Run the AfterQuery on the current result.
+
+        This is a generator step of _evaluation(). An awaitable returned by an async AfterQuery is yielded to the driver.
+
+        Returns:
+            bool: True if the AfterQuery succeeded.
+        """
+        if self.after_query is None:
+            return True
+        error = None
+        after_query_input = self.result
+        start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+        self.graph.timeline.record(self.key, "after_query_start")
+        try:
+            with self.graph._lock: # the temporary changes it makes to the graph are seen by the scheduler at once
+                ret = self.after_query()
+            if inspect.isawaitable(ret):
+                yield ret
+        except AfterQueryError as e:
+            error = e
+        return self._finish_after_query(after_query_input, start_time_ms, error, ignore_errors)
+
+    def _check_dependencies(self):
+        for node in self.adjacent_from:
+            assert node.result is not None, "Dependency {} of {} has been not evaluated".format(node.key, self.key)
+
+    def _retry_prompt(self, prompt, error):
+        temp_prompt = copy.deepcopy(prompt)
+        if error is not None:
+            temp_prompt = self._add_error_msg(temp_prompt, self.result, error)
+        return temp_prompt
 
-    def set_trace(self):
-        if self.graph.chain_span is None:
-            self.chain_span = None
-            return
-        chain_span = Trace(
-            "NodeChain",
-            kind="chain",
-            start_time_ms=round(datetime.datetime.now().timestamp() * 1000),
-            metadata={"prompt": self.prompt, "key": self.key},
-        )
-        self.chain_span = chain_span
-
-    def commit_trace(self):
-        if self.chain_span is None:
-            return
-        self.chain_span._span.end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
-        self.chain_span.add_inputs_and_outputs(inputs={"dependencies": [(node.key,node.result) for node in self.adjacent_from]}, 
-                                               outputs={"response": self.result})
-        self.graph.chain_span.add_child(self.chain_span)
-        self.chain_span = None
+    def _record_usage(self, prompt, usage):
+        if usage is not None:
+            self.counts.append(copy.copy(usage))
+        elif self.token_counter is not None:
+            self.counts.append({'prompt': self.token_counter(prompt), 'completion':self.token_counter(self.result)})
+
+    def _hash_input(self, prompt, shrink_idx):
+        return hashlib.sha1(json.dumps([prompt, shrink_idx], sort_keys=True, default=str).encode()).hexdigest()
+
+    def _update_latency(self):
+        if self.latency is None:
+            self.latency = self._llm_time
+        else:
+            self.latency = self.latency_alpha * self._llm_time + (1 - self.latency_alpha) * self.latency
+
+    def _evaluation(self, fuse=True):
+        """Evaluation of the node as a generator, shared by all evaluation modes.
+
+        The generator yields an LLMRequest whenever the LLM has to be queried, and expects the
+        (result, usage) answer to be sent back. It may also yield an awaitable returned by an async
+        AfterQuery (or by a fused query answered in another task), to be awaited by the driver.
+        The generator returns the result of the node.
+
+        Args:
+            fuse (bool): Whether to share the LLM query with the FusionGroup of the node, if any.
+        """
+        if fuse and self.fusion is not None:
+            return (yield from self.fusion._evaluation(self))
+        run = run_state(self) # read and written many times per evaluation
+        graph = run.graph
+        self._check_dependencies()
+        run.reused = False
+        run._llm_time = 0.
+
+        if not run.temporary_skip:
+            graph.timeline.record(self.key, "compose_start")
+            prompt, shrink_idx = self.compose_prompt()
+            graph.timeline.record(self.key, "compose_end")
+            input_hash = self._hash_input(prompt, shrink_idx) if graph.incremental else None
+            self._print_question()
+            if input_hash is not None and input_hash == run._input_hash:
+                run.reused = True
+                run.result = run._raw_result
+                yield from self._after_query(ignore_errors=True)
+            else:
+                error = None
+                succeeded = False
+                for i in range(3):
+                    if i > 0:
+                        graph.timeline.record(self.key, "retry")
+                    try:
+                        temp_prompt = self._retry_prompt(prompt, error)
+                        run.result, usage = yield LLMRequest(temp_prompt, shrink_idx)
+                        self._record_usage(temp_prompt, usage)
+                        raw_result = run.result
+                        succeeded = yield from self._after_query(ignore_errors=(i==2))
+                        break
+                    except AfterQueryError as e:
+                        error = e.error
+                run._input_hash = input_hash if succeeded else None
+                run._raw_result = raw_result if succeeded else None
+                self._update_latency()
+            self._print_answer(run.result)
+            print()
+        else:
+            run.temporary_skip = False
+        return run.result
 
     def evaluate(self):
         """Evaluate the node by querying the LLM.
 
         Retries the AfterQuery with the LLM up to 3 times in case of an error.
 
+        If the graph is evaluated incrementally and the composed prompt (including rendered db values
+        and dependency results) is identical to the one of the last successful evaluation, the LLM is
+        not queried. The last LLM answer is reused and the AfterQuery is replayed on it.
+
+        Each LLM query is attempted up to max_attempts times. An attempt fails if query_llm raises an
+        exception or takes longer than timeout seconds. A query with a timeout runs in a thread of a shared
+        bounded pool, and a timed out call is told to stop (see agentkit.node_functions.call_in_executor()).
+
         Returns:
             str: Result of the node evaluation.
 
         Raises:
             AssertionError: If any dependency of the node has not been evaluated.
+            TypeError: If the AfterQuery is a coroutine (use aevaluate() instead).
+            LLMQueryError: If all attempts of an LLM query failed (with a timeout or several attempts, otherwise the exception of query_llm is raised).
         """
-        for node in self.adjacent_from:
-            assert node.result is not None, "Dependency {} of {} has been not evaluated".format(node.key, self.key)
+        return self._run(self._evaluation())
 
-        if not self.temporary_skip:
-            self.set_trace()
-            prompt, shrink_idx = self.compose_prompt()
-            error = None
-            self._print_question()
-            for i in range(3):
-                try:
-                    temp_prompt = copy.deepcopy(prompt)
-                    if error is not None:
-                        temp_prompt = self._add_error_msg(temp_prompt, self.result, error)
-                    self.result, usage = self._query_llm(temp_prompt, shrink_idx)
-                    if usage is not None:
-                        self.counts.append(copy.copy(usage))
-                    elif self.token_counter is not None:
-                        self.counts.append({'prompt': self.token_counter(temp_prompt), 'completion':self.token_counter(self.result)})
-                    self._after_query(ignore_errors=(i==2))
-                    break
-                except AfterQueryError as e:
-                    error = e.error
-            self.commit_trace()
-            self._print_answer(self.result)
-            print()
-        else:
-            self.temporary_skip = False
-        return self.result
+    def _run(self, evaluation):
+        # drive an evaluation generator synchronously
+        graph = self.graph
+        history = graph.history
+        try:
+            request = next(evaluation)
+            while True:
+                if not isinstance(request, LLMRequest):
+                    request.close()
+                    evaluation.close()
+                    raise TypeError("The AfterQuery of node {} is a coroutine. Use aevaluate() instead.".format(self.key))
+                reply = self._query_llm(request.prompt, request.shrink_idx)
+                with graph._lock:
+                    if self.key in history.degraded: # given up at the deadline while it was querying (see Graph.evaluate())
+                        raise TimeoutError("The deadline of the evaluation passed")
+                    request = evaluation.send(reply)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            evaluation.close()
+
+    async def aevaluate(self, executor=None):
+        """Evaluate the node by awaiting the LLM.
+
+        Same as evaluate(), except that the LLM query and the AfterQuery retries run as coroutines.
+        query_llm may be an async callable; synchronous callables are run in the given executor.
+        Async query_llm callables are cancelled when they exceed the timeout. Synchronous callables that
+        exceed it are told to stop (see agentkit.node_functions.call_in_executor()).
+
+        Args:
+            executor (concurrent.futures.Executor): Executor for synchronous query_llm callables. Defaults to the event loop's default executor.
+
+        Returns:
+            str: Result of the node evaluation.
+
+        Raises:
+            AssertionError: If any dependency of the node has not been evaluated.
+            LLMQueryError: If all attempts of an LLM query failed (with a timeout or several attempts, otherwise the exception of query_llm is raised).
+        """
+        return await self._arun(self._evaluation(), executor)
+
+    async def _arun(self, evaluation, executor=None):
+        # drive an evaluation generator on the event loop
+        try:
+            request = next(evaluation)
+            while True:
+                if isinstance(request, LLMRequest):
+                    request = evaluation.send(await self._aquery_llm(request.prompt, request.shrink_idx, executor=executor))
+                else:
+                    try:
+                        await request
+                    except AfterQueryError as e:
+                        request = evaluation.throw(e)
+                    else:
+                        request = evaluation.send(None)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            evaluation.close()
+
+    def _start_refresh(self):
+        # compose the prompt with the current inputs and query the LLM in the background
+        evaluation = self._evaluation(fuse=False)
+        try:
+            request = next(evaluation)
+        except StopIteration: # skipped or reused, the result is already fresh
+            return False
+        self._refresh = (evaluation, self._submit_refresh(evaluation, request))
+        return True
+
+    def _submit_refresh(self, evaluation, request):
+        if not isinstance(request, LLMRequest):
+            request.close()
+            evaluation.close()
+            raise TypeError("The AfterQuery of node {} is a coroutine, which is not supported with stale_while_revalidate.".format(self.key))
+        return call_in_thread(self._query_llm, request.prompt, request.shrink_idx, self.graph.timeline)
+
+    def _finish_refresh(self):
+        """Apply the background refresh of the node if its LLM query has returned.
+
+        The AfterQuery runs in the calling thread. If it asks for a retry, the new query is sent in the background.
+
+        Returns:
+            bool: Whether the refresh is over.
+
+        Raises:
+            LLMQueryError: If all attempts of the LLM query failed.
+        """
+        evaluation, future = self._refresh
+        if not future.done():
+            return False
+        self._refresh = None
+        try:
+            request = evaluation.send(future.result())
+        except StopIteration:
+            return True
+        except BaseException:
+            evaluation.close()
+            raise
+        self._refresh = (evaluation, self._submit_refresh(evaluation, request))
+        return False
 
     def get_token_counts(self):
         """Get the LLM token counts for the specific node since instantiation.
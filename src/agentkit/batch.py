@@ -0,0 +1,176 @@
+import concurrent.futures
+import copy
+import datetime
+from .base_node import LLMRequest
+from .exceptions import LLMQueryError
+from .node_functions import get_batch_query, call_in_executor
+
+class GraphBatch:
+    """A class to evaluate several structurally identical graphs in lockstep.
+
+    Each graph keeps its own nodes, database and history (e.g. one graph per episode).
+    GraphBatch advances all graphs together: at every round, each graph dispatches all of
+    its ready nodes, and the pending LLM requests of all graphs are grouped by query_llm,
+    so that instances of the same node are sent to the LLM in a single call.
+
+    A query_llm is batch-capable if it (or the function wrapped by a functools.partial)
+    has a ``batch`` method taking a list of prompts and a list of shrink indices, and
+    returning a list of (result, usage) pairs, such as agentkit.llm_api.base.BaseModel.batch.
+    Requests to other functions are sent one at a time. The driver is single-threaded.
+
+    Nodes with the same query_llm are only batched if they have the same timeout and max_attempts
+    (see BaseNode). A failed batch call is attempted again for all its requests, and a node whose
+    attempts all fail falls back to its previous result, as with Graph.evaluate() (see History.failed).
+
+    Each graph must have its own ComposePrompt and AfterQuery objects: they are bound to a single node
+    (see set_node()), so an object shared by the instances of a node in several graphs would compose
+    or post-process the wrong one. Graphs built from shared definitions should copy them per graph.
+
+    Attributes:
+        graphs (list): A list of Graph objects.
+    """
+    def __init__(self, graphs):
+        """Initializes the GraphBatch class.
+
+        Args:
+            graphs (list): A list of Graph objects with the same node keys.
+
+        Raises:
+            AssertionError: If the graphs do not have the same nodes, or if they share a ComposePrompt or AfterQuery object.
+        """
+        assert len(graphs) > 0, "GraphBatch requires at least one graph"
+        for graph in graphs[1:]:
+            assert graph.nodes.keys() == graphs[0].nodes.keys(), "Graphs in a GraphBatch must have the same nodes"
+        owners = {} # id of a ComposePrompt or AfterQuery object -> graph of the node it is bound to
+        for graph in graphs:
+            for node in graph.nodes.values():
+                for obj in (node._compose_prompt, node.after_query):
+                    if obj is not None:
+                        assert owners.setdefault(id(obj), graph) is graph, "The {} of node {} is shared by several graphs in a GraphBatch. Each graph must have its own.".format(type(obj).__name__, node.key)
+        self.graphs = graphs
+
+    def _advance(self, graph, node, evaluation, reply):
+        """Advance the evaluation of a node until its next LLM request.
+
+        Returns:
+            LLMRequest: The next request, or None if the node has been evaluated.
+        """
+        try:
+            request = evaluation.send(reply)
+        except StopIteration as stop:
+            graph._complete_node(node.key, stop.value)
+            return None
+        if not isinstance(request, LLMRequest):
+            request.close()
+            evaluation.close()
+            raise TypeError("The AfterQuery of node {} is a coroutine, which is not supported by GraphBatch.".format(node.key))
+        return request
+
+    def _query(self, query_llm, pending):
+        """Query the LLM for a group of requests, with the timeout and the attempts of their nodes.
+
+        Returns:
+            list: The (result, usage) reply to each request, or the LLMQueryError of the requests whose attempts all failed.
+        """
+        batch_query = get_batch_query(query_llm)
+        if batch_query is None:
+            replies = []
+            for _, node, _, request in pending:
+                try:
+                    replies.append(node._query_llm(request.prompt, request.shrink_idx))
+                except LLMQueryError as e:
+                    replies.append(e)
+            return replies
+        timeout, max_attempts = pending[0][1].timeout, pending[0][1].max_attempts
+        replies = [None] * len(pending)
+        errors = [[] for _ in pending]
+        for _ in range(max_attempts):
+            for (graph, node, _, request), node_errors in zip(pending, errors):
+                if len(node_errors) > 0:
+                    graph.timeline.record(node.key, "retry")
+                graph.timeline.record(node.key, "llm_send")
+                node._emit("on_llm_request", node, request.prompt)
+            prompts = [request.prompt for _, _, _, request in pending]
+            shrink_idxs = [request.shrink_idx for _, _, _, request in pending]
+            start_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            error = None
+            call = None
+            try:
+                if timeout is None:
+                    results = batch_query(prompts, shrink_idxs)
+                else: # see BaseNode._query_llm()
+                    call = call_in_executor(batch_query, copy.deepcopy(prompts), shrink_idxs, timeout=timeout)
+                    results = call.result(timeout=timeout)
+            except concurrent.futures.TimeoutError:
+                error = TimeoutError("LLM query timed out after {} seconds".format(timeout))
+            except Exception as e:
+                if not pending[0][1]._falls_back():
+                    raise
+                error = e
+            finally:
+                if call is not None and not call.done():
+                    call.abandon()
+                for graph, node, _, _ in pending:
+                    graph.timeline.record(node.key, "llm_return")
+            if error is not None:
+                for node_errors in errors:
+                    node_errors.append(error)
+                continue
+            assert len(results) == len(prompts), "Batch query returned {} results for {} prompts".format(len(results), len(prompts))
+            end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
+            for (graph, node, _, request), result in zip(pending, results):
+                node._record_llm_call(request.prompt, result, start_time_ms, end_time_ms)
+            return results
+        return [node._query_failed(node_errors) for (_, node, _, _), node_errors in zip(pending, errors)]
+
+    def evaluate(self, incremental=False):
+        """Evaluate all graphs in lockstep.
+
+        Args:
+            incremental (bool): Reuse the previous result of nodes whose composed prompt did not change (see Graph.evaluate()).
+
+        Returns:
+            list: The History of each graph, in the order of self.graphs.
+
+        Raises:
+            LLMQueryError: If all attempts of an LLM query failed and its node has no result to fall back to.
+        """
+        for graph in self.graphs:
+            graph._begin_evaluation(incremental=incremental)
+        pending = [] # (graph, node, evaluation, request)
+        try:
+            while True:
+                for graph in self.graphs:
+                    while True:
+                        node_key = graph._next_ready_node()
+                        if node_key is None:
+                            break
+                        if graph._complete_if_unneeded(node_key) is not None:
+                            continue
+                        node = graph.get_node_with_temporary(node_key)
+                        evaluation = node._evaluation(fuse=False) # instances of a node are batched instead
+                        request = self._advance(graph, node, evaluation, None) # this may change the graph
+                        if request is not None:
+                            pending.append((graph, node, evaluation, request))
+                if len(pending) == 0:
+                    break
+                groups = {}
+                for item in pending:
+                    node = item[1]
+                    groups.setdefault((id(node.query_llm), node.timeout, node.max_attempts), []).append(item)
+                pending = []
+                for group in groups.values():
+                    replies = self._query(group[0][1].query_llm, group)
+                    for (graph, node, evaluation, _), reply in zip(group, replies):
+                        if isinstance(reply, LLMQueryError):
+                            evaluation.close()
+                            graph._fail_node(node.key, reply)
+                            continue
+                        request = self._advance(graph, node, evaluation, reply) # this may change the graph
+                        if request is not None:
+                            pending.append((graph, node, evaluation, request))
+        except BaseException: # revert the temporary modifications of every graph, as Graph.evaluate() does
+            for graph in self.graphs:
+                graph._abort_evaluation()
+            raise
+        return [graph._end_evaluation() for graph in self.graphs]
@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+
+_current = contextvars.ContextVar("agentkit_execution_context", default=None)
+
+def current_context():
+    """Get the ExecutionContext that the calling code runs in.
+
+    Returns:
+        ExecutionContext: The current context, or None outside of any context.
+    """
+    return _current.get()
+
+class RunState:
+    """Descriptor of an attribute that belongs to the state of an evaluation rather than to the graph definition.
+
+    Outside of any ExecutionContext, the value is stored on the object itself. Inside a context, each
+    object has its own value in the context, so that the same graph and nodes can be evaluated by
+    several contexts concurrently. A value that has not been set in a context starts from the default,
+    or is derived from the value stored on the object if inherit is given.
+
+    Each access looks up the current context. Code that reads or writes many of these attributes (e.g. the
+    scheduler of Graph) looks up their RunValues once with run_state() instead.
+    """
+    def __init__(self, default=None, factory=None, inherit=None):
+        """Initializes the RunState class.
+
+        Args:
+            default (Any): Initial value.
+            factory (Callable): Function that creates the initial value (for mutable values).
+            inherit (Callable): Function of (context, value) that derives the initial value in a context from the value stored on the object.
+        """
+        self.default = default
+        self.factory = factory
+        self.inherit = inherit
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def _initial(self, context, own):
+        if context is not None and self.inherit is not None and self.name in own.__dict__:
+            return self.inherit(context, own.__dict__[self.name])
+        if self.factory is not None:
+            return self.factory()
+        return self.default
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        context = _current.get()
+        values = obj._own_state if context is None else context._state_of(obj)
+        try:
+            return values.__dict__[self.name]
+        except KeyError:
+            return getattr(values, self.name)
+
+    def __set__(self, obj, value):
+        context = _current.get()
+        values = obj._own_state if context is None else context._state_of(obj)
+        values.__dict__[self.name] = value
+
+class RunValues:
+    """The values of the RunState attributes of an object, outside of any context or in one ExecutionContext.
+
+    The values are plain attributes. An attribute that has not been set is initialized when it is first read.
+    """
+    def __init__(self, cls, context=None, own=None):
+        """Initializes the RunValues class.
+
+        Args:
+            cls (type): Class of the object, which declares the RunState attributes.
+            context (ExecutionContext): The context of the values, or None for the values stored on the object.
+            own (RunValues): The values stored on the object, for values in a context.
+        """
+        self.__cls = cls
+        self.__context = context
+        self.__own = own
+
+    def __getattr__(self, name):
+        state = getattr(self.__cls, name, None) if not name.startswith("_RunValues__") else None
+        if not isinstance(state, RunState):
+            raise AttributeError(name)
+        # threads reading it at the same time must get the same (e.g. mutable) value
+        return self.__dict__.setdefault(name, state._initial(self.__context, self.__own))
+
+def run_state(obj):
+    """Get the RunState values of an object in the current context.
+
+    Args:
+        obj (Any): An object with RunState attributes (e.g. a Graph or a node).
+
+    Returns:
+        RunValues: The values, whose attributes are the RunState attributes of the object.
+    """
+    context = _current.get()
+    return obj._own_state if context is None else context._state_of(obj)
+
+def same_value(context, value):
+    # inherit the value stored on the object as is
+    return value
+
+class ExecutionContext:
+    """The state of the evaluations of a graph in one session.
+
+    A Graph and its nodes, ComposePrompt and AfterQuery objects form a definition that can be shared by many
+    sessions. The results of the nodes, the temporary nodes and edges, the history and the scheduling
+    state of the graph are attributes of the nodes and of the graph, but they are kept by the ExecutionContext
+    that the code runs in (see RunState), so that each session has its own. ComposePrompt and AfterQuery
+    objects keep reading and writing them as node attributes (e.g. self.node.result, self.node.db).
+
+    Code runs in a context through run(), evaluate(), evaluate_iter() or aevaluate(). Threads and tasks
+    started by the evaluation inherit the context. Code that runs outside of any context uses the state
+    stored on the graph and nodes themselves, as if they formed a single session.
+
+    The permanent graph (nodes, edges and orders) must not be modified inside a context.
+
+    Attributes:
+        graph (Graph): The graph evaluated by the session.
+        database (dict): Database read and written by the nodes in this session instead of their own (SimpleDBNode.db), or None to use theirs.
+    """
+    def __init__(self, graph, database=None):
+        """Initializes the ExecutionContext class.
+
+        Args:
+            graph (Graph): The graph evaluated by the session.
+            database (dict): Database of the session. Defaults to None (the database of each node).
+        """
+        self.graph = graph
+        self.database = database
+        self._values = {} # object -> RunValues
+
+    def _state_of(self, obj):
+        values = self._values.get(obj)
+        if values is None:
+            values = self._values.setdefault(obj, RunValues(type(obj), self, obj._own_state))
+        return values
+
+    def _forget(self, obj):
+        # drop the state of an object that is no longer used (e.g. a temporary node)
+        self._values.pop(obj, None)
+
+    def run(self, fn, *args, **kwargs):
+        """Call a function in the context.
+
+        Args:
+            fn (Callable): Function to call.
+            *args: Positional arguments of the call.
+            **kwargs: Keyword arguments of the call.
+
+        Returns:
+            Any: The result of the call.
+        """
+        context = contextvars.copy_context()
+        context.run(_current.set, self)
+        return context.run(fn, *args, **kwargs)
+
+    def evaluate(self, *args, **kwargs):
+        """Evaluate the graph in the context (see Graph.evaluate()).
+
+        Returns:
+            History: A dictionary of the results from the graph.
+        """
+        return self.run(self.graph.evaluate, *args, **kwargs)
+
+    def evaluate_iter(self, *args, **kwargs):
+        """Evaluate the graph in the context, yielding node results as they complete (see Graph.evaluate_iter()).
+
+        Yields:
+            tuple: (key, result, timing) of each evaluated node.
+        """
+        evaluation = self.graph.evaluate_iter(*args, **kwargs)
+        try:
+            while True:
+                try:
+                    item = self.run(next, evaluation)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            self.run(evaluation.close)
+
+    async def aevaluate(self, *args, **kwargs):
+        """Evaluate the graph in the context, on the running event loop (see Graph.aevaluate()).
+
+        Returns:
+            History: A dictionary of the results from the graph.
+        """
+        # tasks copy the context they are created in
+        return await self.run(asyncio.ensure_future, self.graph.aevaluate(*args, **kwargs))
+
+    @property
+    def history_list(self):
+        """list: The History of each evaluation of the session."""
+        return self.run(getattr, self.graph, "history_list")
+
+    @property
+    def num_iter(self):
+        """int: The number of evaluations of the session."""
+        return self.run(getattr, self.graph, "num_iter")
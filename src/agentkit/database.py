@@ -0,0 +1,262 @@
+from collections import namedtuple
+import copy
+import threading
+
+_DELETED = object()
+
+DatabaseConflict = namedtuple("DatabaseConflict", ["key", "other", "path", "kind"])
+DatabaseConflict.__doc__ = """A conflict between two nodes evaluated concurrently on a Database: the node (key) read ("read") or wrote ("write") the value at path (a tuple of keys) that the other node wrote."""
+
+def _overlap(path, other):
+    # whether one path contains the other
+    n = min(len(path), len(other))
+    return path[:n] == other[:n]
+
+def _plain(value):
+    # convert the tracked dicts of a view back to plain dicts
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in dict.items(value)}
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
+
+def _diff(old, new, path, writes):
+    # (path, value) of the changes from old to new; nested dicts are compared key by key, other values as a whole
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in dict.keys(old):
+            if not dict.__contains__(new, key):
+                writes.append((path + (key,), _DELETED))
+        for key, value in dict.items(new):
+            if not dict.__contains__(old, key):
+                writes.append((path + (key,), _plain(value)))
+            else:
+                _diff(dict.__getitem__(old, key), value, path + (key,), writes)
+    elif type(old) is not type(new) or old != new:
+        writes.append((path, _plain(new)))
+
+class _TrackedDict(dict):
+    """A copy of a dict of the database, private to a node, that records the paths the node reads."""
+    __slots__ = ("_view", "_path")
+
+    def __init__(self, view, path, data):
+        super().__init__(data)
+        self._view = view
+        self._path = path
+
+    def _read_key(self, key):
+        value = dict.get(self, key, _DELETED)
+        if not isinstance(value, _TrackedDict): # tracked dicts record the reads inside them
+            self._view._reads.add(self._path + (key,))
+
+    def _read_all(self):
+        self._view._reads.add(self._path)
+
+    def __getitem__(self, key):
+        self._read_key(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._read_key(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._view._reads.add(self._path + (key,))
+        return super().__contains__(key)
+
+    def setdefault(self, key, default=None):
+        self._read_key(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        self._read_key(key)
+        return super().pop(key, *args)
+
+    def __iter__(self):
+        self._read_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self._read_all()
+        return super().__len__()
+
+    def keys(self):
+        self._read_all()
+        return super().keys()
+
+    def values(self):
+        self._read_all()
+        return super().values()
+
+    def items(self):
+        self._read_all()
+        return super().items()
+
+    def __repr__(self):
+        self._read_all()
+        return super().__repr__()
+
+    __str__ = __repr__
+
+    def copy(self):
+        self._read_all()
+        return _plain(self)
+
+    def __reduce_ex__(self, protocol):
+        # copies are plain dicts
+        return dict, (dict(super().items()),)
+
+def _track(value, view, path):
+    if isinstance(value, dict):
+        return _TrackedDict(view, path, {key: _track(item, view, path + (key,)) for key, item in value.items()})
+    return copy.deepcopy(value)
+
+class DatabaseView(_TrackedDict):
+    """The database as seen by one node during its evaluation (see Database).
+
+    Attributes:
+        database (Database): The database the view was taken from.
+        key (str): Key of the node.
+        rank (tuple): Position of the node in the serial order of the evaluation.
+    """
+    __slots__ = ("database", "key", "rank", "_base", "_seq", "_token", "_reads")
+
+    def __init__(self, database, key, rank, base, seq, token):
+        self._reads = set()
+        super().__init__(self, (), {name: _track(value, self, (name,)) for name, value in base.items()})
+        self.database = database
+        self.key = key
+        self.rank = rank
+        self._base = base
+        self._seq = seq
+        self._token = token
+
+_Commit = namedtuple("_Commit", ["seq", "key", "rank", "reads", "writes"])
+
+class Database(dict):
+    """A database (dict) that nodes can read and write while they are evaluated concurrently.
+
+    When the graph starts evaluating a node whose database (SimpleDBNode.db) is a Database, the node gets a
+    private copy of it (a DatabaseView), taken after the writes of its dependencies were committed. The node
+    reads a consistent snapshot, whatever the other nodes write in the meantime, and its writes are buffered
+    in the copy. When the node completes, the changes it made (down to the keys of nested dicts; other values,
+    such as lists, are compared as a whole) are committed to the database. Nodes that fall back to their
+    previous result (see History.degraded and History.failed) do not commit their writes.
+
+    Nodes evaluated concurrently commit in the order they complete. A difference with a serial evaluation,
+    in the topological order of the graph, is reported as a DatabaseConflict in History.conflicts and in
+    conflicts:
+
+    - "read": the node read a value that a node before it in the topological order wrote concurrently (or a
+      node after it read a value that the node wrote), so the node that read it did not see the value it
+      would have seen in a serial evaluation.
+    - "write": both nodes wrote the same value. The writes are applied in the topological order, whichever
+      node completes first, so that the database is the same as in a serial evaluation.
+
+    Values of the database must be plain data: they are deep-copied for each node and compared with ==.
+    Outside of an evaluation, the database is a plain dict and can be modified freely (e.g. to set the new
+    observation). Committed values are not modified in place, so references to them taken during an
+    evaluation keep their value.
+
+    Attributes:
+        conflicts (list): DatabaseConflict of every conflict detected so far.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.conflicts = []
+        self._lock = threading.Lock()
+        self._seq = 0 # number of commits
+        self._log = [] # _Commit of the commits that open views did not see
+        self._open = {} # token of each open view -> seq of the view
+
+    def __deepcopy__(self, memo):
+        # copies are plain dicts
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+    def view(self, key, rank=()):
+        """Open a private copy of the database for a node.
+
+        Args:
+            key (str): Key of the node.
+            rank (tuple): Position of the node in the serial order of the evaluation.
+
+        Returns:
+            DatabaseView: The copy of the database.
+        """
+        token = object()
+        with self._lock:
+            base = dict.copy(self)
+            seq = self._seq
+            self._open[token] = seq
+        return DatabaseView(self, key, rank, base, seq, token)
+
+    def discard(self, view):
+        """Close a view without committing its writes.
+
+        Args:
+            view (DatabaseView): The view to close.
+        """
+        with self._lock:
+            self._close(view)
+
+    def commit(self, view):
+        """Commit the writes of a view and close it.
+
+        Args:
+            view (DatabaseView): The view to commit.
+
+        Returns:
+            list: DatabaseConflict of the conflicts with the nodes that committed concurrently.
+
+        Raises:
+            AssertionError: If the view was already committed or discarded.
+        """
+        writes = []
+        _diff(view._base, view, (), writes)
+        reads = view._reads
+        with self._lock:
+            assert view._token in self._open, "View of node {} is already closed".format(view.key)
+            conflicts = []
+            later = [] # writes of concurrent nodes after this one in the serial order, applied again on top
+            for commit in self._log:
+                if commit.seq < view._seq:
+                    continue
+                for path, value in commit.writes:
+                    if commit.rank < view.rank and any(_overlap(path, read) for read in reads):
+                        conflicts.append(DatabaseConflict(view.key, commit.key, path, "read"))
+                    if any(_overlap(path, write) for write, _ in writes):
+                        conflicts.append(DatabaseConflict(view.key, commit.key, path, "write"))
+                        if commit.rank > view.rank:
+                            later.append((path, value))
+                if commit.rank > view.rank:
+                    for path, _ in writes:
+                        if any(_overlap(path, read) for read in commit.reads):
+                            conflicts.append(DatabaseConflict(commit.key, view.key, path, "read"))
+            for path, value in writes + later:
+                self._apply(path, value)
+            self._log.append(_Commit(self._seq, view.key, view.rank, reads, writes))
+            self._seq += 1
+            self._close(view)
+            self.conflicts += conflicts
+        return conflicts
+
+    def _close(self, view):
+        self._open.pop(view._token, None)
+        # commits seen by every open view are not needed anymore
+        oldest = min(self._open.values(), default=self._seq)
+        self._log = [commit for commit in self._log if commit.seq >= oldest]
+
+    def _apply(self, path, value):
+        # copy the nested dicts along the path, so that committed values are never modified in place
+        parent = self
+        for i, name in enumerate(path[:-1]):
+            child = dict.get(parent, name)
+            child = dict(child) if isinstance(child, dict) else {}
+            dict.__setitem__(parent, name, child)
+            parent = child
+        if value is _DELETED:
+            dict.pop(parent, path[-1], None)
+        else:
+            dict.__setitem__(parent, path[-1], copy.deepcopy(value))
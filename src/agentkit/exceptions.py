@@ -17,4 +17,22 @@ class AfterQueryError(Exception):
         super().__init__(message)
             
         # Set the error message
-        self.error = error
\ No newline at end of file
+        self.error = error
+class LLMQueryError(Exception):
+    """Exception raised when a node fails to query the LLM within its attempts.
+
+    Attributes:
+        key (str): Key of the node.
+        errors (list): Exception raised by each attempt (TimeoutError if the attempt timed out).
+    """
+    def __init__(self, message, key, errors):
+        """Initializes the LLMQueryError class.
+
+        Args:
+            message (str): System error message.
+            key (str): Key of the node.
+            errors (list): Exception raised by each attempt.
+        """
+        super().__init__(message)
+        self.key = key
+        self.errors = errors
@@ -0,0 +1,273 @@
+from .base_node import BaseNode, LLMRequest
+from .context import current_context
+from .exceptions import AfterQueryError
+from .utils import extract_json_objects
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+FUSED_INSTRUCTION = "Answer each of the following questions separately. Respond with a single JSON object that maps the key of each question to its answer (a string), e.g. {{{}}}."
+
+class _Claim:
+    """The part of a node in the fused query of the current evaluation."""
+    def __init__(self, history, lead):
+        self.history = history # identifies the evaluation
+        self.lead = lead # key of the node that leads the query
+        self.future = concurrent.futures.Future() # ("answer", reply), ("result", result) or ("alone", None)
+        self.evaluation = None
+        self.request = None
+
+def _resume(evaluation, reply):
+    # drive the rest of a started evaluation, whose pending LLMRequest gets reply
+    try:
+        request = evaluation.send(reply)
+        while True:
+            try:
+                reply = yield request
+            except AfterQueryError as e: # raised by an async AfterQuery
+                request = evaluation.throw(e)
+            else:
+                request = evaluation.send(reply)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        evaluation.close()
+
+def _split_usage(usage, n):
+    if usage is None:
+        return [None] * n
+    parts = [dict(usage) for _ in range(n)]
+    for name, value in usage.items():
+        if isinstance(value, int):
+            for i, part in enumerate(parts):
+                part[name] = value // n + (1 if i < value % n else 0)
+    return parts
+
+def fuse_prompts(keys, requests):
+    """Combine the LLM requests of sibling nodes into a single request.
+
+    The messages that all prompts start with are kept as they are, and the remaining messages of each
+    prompt become a question, labelled with the key of its node, in a final user message.
+
+    Args:
+        keys (list): Keys of the nodes.
+        requests (list): LLMRequest of each node.
+
+    Returns:
+        LLMRequest: The fused request, or None if the prompts cannot be fused (they must share the message that is shrunk).
+    """
+    prefix = 0
+    while all(prefix < len(request.prompt) - 1 and request.prompt[prefix] == requests[0].prompt[prefix] for request in requests):
+        prefix += 1
+    shrink_idx = requests[0].shrink_idx
+    if any(request.shrink_idx != shrink_idx for request in requests) or (shrink_idx is not None and shrink_idx >= prefix):
+        return None
+    example = ", ".join('"{}": "..."'.format(key) for key in keys)
+    sections = [FUSED_INSTRUCTION.format(example)]
+    for key, request in zip(keys, requests):
+        question = "\n\n".join(message["content"] for message in request.prompt[prefix:])
+        sections.append("Question {}:\n\n{}".format(json.dumps(key), question))
+    prompt = [dict(message) for message in requests[0].prompt[:prefix]]
+    prompt.append({"role": "user", "content": "\n\n".join(sections)})
+    return LLMRequest(prompt, shrink_idx)
+
+def split_answer(keys, result):
+    """Split the answer to a fused request into the answers of the nodes.
+
+    Args:
+        keys (list): Keys of the nodes.
+        result (str): Answer of the LLM.
+
+    Returns:
+        dict: The answer of each node found in the answer.
+    """
+    objects, _ = extract_json_objects(result) if isinstance(result, str) else (None, None)
+    for obj in objects or []:
+        if isinstance(obj, dict) and any(key in obj for key in keys):
+            return {key: value if isinstance(value, str) else json.dumps(value) for key, value in obj.items() if key in keys}
+    return {}
+
+class FusionGroup:
+    """Sibling nodes whose LLM queries are sent as a single request (see fuse_nodes()).
+
+    The first node of the group that the graph evaluates composes the prompts of the other nodes that have not
+    been evaluated yet, and sends them in a single request asking for a JSON object keyed by node. When the other
+    nodes are evaluated, they take their part of the answer and run their AfterQuery as usual. A node whose answer
+    is missing (or whose prompt cannot be fused) queries the LLM on its own. Retries of the AfterQuery are sent on
+    their own too. The token usage of the fused request is split evenly among the nodes.
+
+    The nodes are composed before they are dispatched, so an AfterQuery must not change the inputs of the other
+    nodes of its group (e.g. skip them) during the evaluation.
+
+    Attributes:
+        nodes (list): The nodes of the group.
+        queries (int): Number of fused requests sent.
+    """
+    def __init__(self, nodes):
+        """Initializes the FusionGroup class.
+
+        Args:
+            nodes (list): The nodes of the group.
+        """
+        self.nodes = nodes
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def _claim(self, node):
+        """Get the claim of a node on the fused query of the current evaluation.
+
+        Returns:
+            tuple: (claim, followers). followers are the nodes claimed by the node if it leads the query.
+        """
+        graph = node.graph
+        history = graph.history
+        with self._lock:
+            claim = node._fused
+            if claim is not None and claim.history is history:
+                return claim, []
+            if claim is not None and claim.evaluation is not None: # never dispatched
+                claim.evaluation.close()
+            node._fused = _Claim(history, node.key)
+            followers = []
+            for other in self.nodes:
+                if other is node or other.graph is not graph or not graph._pending(other.key):
+                    continue
+                if other._fused is None or other._fused.history is not history: # not started
+                    other._fused = _Claim(history, node.key)
+                    followers.append(other)
+            return node._fused, followers
+
+    def _evaluation(self, node):
+        claim, followers = self._claim(node)
+        if claim.lead != node.key:
+            return (yield from self._follow(node, claim))
+        return (yield from self._lead(node, followers))
+
+    def _follow(self, node, claim):
+        if not claim.future.done():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError: # evaluated by a thread while the lead waits for the LLM
+                claim.future.result()
+            else:
+                yield asyncio.wrap_future(claim.future)
+        kind, value = claim.future.result()
+        evaluation, request = claim.evaluation, claim.request
+        claim.evaluation = None
+        if kind == "result":
+            return value
+        if kind == "answer":
+            node.graph.timeline.record(node.key, "fused", claim.lead)
+            return (yield from _resume(evaluation, value))
+        if evaluation is None: # not composed by the lead
+            return (yield from node._evaluation(fuse=False))
+        return (yield from self._alone(evaluation, request))
+
+    def _lead(self, node, followers):
+        claims = {other: other._fused for other in followers}
+        evaluation = node._evaluation(fuse=False)
+        try:
+            try:
+                pending = [(node, next(evaluation))]
+            except StopIteration as stop: # skipped or reused
+                return stop.value
+            for other, claim in claims.items():
+                request = self._compose(other, claim)
+                if request is not None:
+                    pending.append((other, request))
+            keys = [other.key for other, _ in pending]
+            request = fuse_prompts(keys, [request for _, request in pending]) if len(pending) > 1 else None
+            if request is None:
+                return (yield from self._alone(evaluation, pending[0][1]))
+            self.queries += 1
+            result, usage = yield request
+            answers = split_answer(keys, result)
+            usages = _split_usage(usage, len(pending))
+            for (other, _), other_usage in zip(pending[1:], usages[1:]):
+                if other.key in answers:
+                    claims[other].future.set_result(("answer", (answers[other.key], other_usage)))
+            if node.key not in answers:
+                return (yield from self._alone(evaluation, pending[0][1]))
+            return (yield from _resume(evaluation, (answers[node.key], usages[0])))
+        finally:
+            for claim in claims.values():
+                if not claim.future.done():
+                    claim.future.set_result(("alone", None))
+            evaluation.close()
+
+    def _compose(self, node, claim):
+        """Compose the prompt of a follower, in the thread of the lead.
+
+        Returns:
+            LLMRequest: The request of the follower, or None if it does not query the LLM.
+        """
+        evaluation = node._evaluation(fuse=False)
+        try:
+            request = next(evaluation)
+        except StopIteration as stop: # skipped or reused
+            claim.future.set_result(("result", stop.value))
+            return None
+        except BaseException as e: # raised when the follower is evaluated
+            claim.future.set_exception(e)
+            return None
+        claim.evaluation = evaluation
+        claim.request = request
+        return request
+
+    def _alone(self, evaluation, request):
+        reply = yield request
+        return (yield from _resume(evaluation, reply))
+
+def _signature(node):
+    # nodes with the same signature can be fused
+    if type(node)._evaluation is not BaseNode._evaluation or node.deferred or node.stale_while_revalidate or node.condition is not None or node.schedule is not None:
+        return None
+    dependencies = frozenset(dependency.key for dependency in node.adjacent_from)
+    orders = frozenset(dependency.key for dependency in node.evaluate_after)
+    return (type(node._compose_prompt), dependencies, orders, node.query_llm)
+
+def fuse_nodes(graph, keys=None):
+    """Fuse the LLM queries of sibling nodes of a graph.
+
+    An optional optimization pass: nodes that have the same ComposePrompt class, the same dependencies and
+    orders, and the same query_llm (e.g. several questions about the same observation) are grouped, and
+    the nodes of each group are answered by a single LLM request (see FusionGroup). This saves the
+    tokens of the messages that their prompts share, and round trips. Deferred, stale_while_revalidate,
+    conditional, scheduled and MapNode nodes are not fused. The groups are updated by calling fuse_nodes() again after the graph changes.
+
+    Args:
+        graph (Graph): The graph.
+        keys (list): Keys of the nodes that may be fused. Defaults to None (all nodes).
+
+    Returns:
+        list: The FusionGroup of each group of fused nodes.
+
+    Raises:
+        AssertionError: If called inside an ExecutionContext.
+    """
+    assert current_context() is None, "Nodes cannot be fused inside an ExecutionContext"
+    nodes = [graph.nodes[key] for key in keys] if keys is not None else list(graph.nodes.values())
+    siblings = {}
+    for node in nodes:
+        node.fusion = None
+        signature = _signature(node)
+        if signature is not None:
+            siblings.setdefault(signature, []).append(node)
+    groups = []
+    for group in siblings.values():
+        if len(group) > 1:
+            fusion = FusionGroup(group)
+            for node in group:
+                node.fusion = fusion
+            groups.append(fusion)
+    return groups
+
+def unfuse_nodes(graph):
+    """Undo fuse_nodes().
+
+    Args:
+        graph (Graph): The graph.
+    """
+    for node in graph.nodes.values():
+        node.fusion = None
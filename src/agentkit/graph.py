@@ -1,10 +1,64 @@
-from collections import deque
-import datetime
-try:
-    from wandb.sdk.data_types.trace_tree import Trace
-except:
-    print("wandb Trace seems to be missing. This is fine if you are not using wandb")
-    pass
+from collections import deque, namedtuple
+from .plan import ExecutionPlan
+from .timeline import Timeline
+from .context import ExecutionContext, RunState, RunValues, run_state, current_context
+from .database import Database, DatabaseView
+from .exceptions import LLMQueryError
+from .node_functions import call_in_thread
+import asyncio
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextvars
+import copy
+import threading
+import time
+
+_UNDISCOVERED, _DISCOVERED, _DISPATCHED = 0, 1, 2
+
+NodeTiming = namedtuple("NodeTiming", ["start", "end", "llm_time"])
+NodeTiming.__doc__ = """Timing of a node evaluation: start and end wall-clock times (seconds since the epoch) and the time spent querying the LLM (seconds)."""
+
+class History(dict):
+    """Results of one graph evaluation.
+
+    A dictionary mapping node keys to results, annotated with how the results were obtained.
+
+    Attributes:
+        reused (set): Keys of the nodes whose previous result was reused without querying the LLM.
+        skipped (set): Keys of the nodes that were not evaluated because they are not needed by the targets of the evaluation. Their previous result (or None) is reported.
+        degraded (set): Keys of the nodes that were not evaluated (or were cancelled) because the deadline of the evaluation passed. Their previous result, or their default_result, is reported.
+        deferred (set): Keys of the deferred nodes that had not completed when the evaluation returned. Their results are added once they complete (see Graph.join()).
+        stale (set): Keys of the stale_while_revalidate nodes whose last result was reported while a refresh runs in the background.
+        prefetched (set): Keys of the nodes that a Pipeline evaluated ahead, while the deferred nodes of the previous evaluation were running.
+        cached (set): Keys of the nodes that reused their cached result because they were not due at this iteration (see BaseNode.schedule), or because the evaluation took the fast path (see Graph.novelty).
+        novelty (float): Novelty of the observation at the beginning of the evaluation, if the graph has a NoveltyDetector (see Graph.novelty).
+        fast (bool): Whether the evaluation took the fast path (see Graph.novelty).
+        gated (set): Keys of the nodes that did not query the LLM because their condition was false (see BaseNode.condition).
+        failed (dict): LLMQueryError of each node whose LLM queries failed (see BaseNode.max_attempts). Their previous result, or their default_result, is reported.
+        conflicts (list): DatabaseConflict of the nodes whose reads or writes of a Database differ from a serial evaluation (see Database).
+        timeline (Timeline): Timeline of the evaluation.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reused = set()
+        self.skipped = set()
+        self.degraded = set()
+        self.deferred = set()
+        self.stale = set()
+        self.prefetched = set()
+        self.cached = set()
+        self.novelty = None
+        self.fast = False
+        self.gated = set()
+        self.failed = {}
+        self.conflicts = []
+        self.timeline = None
+
+    def copy(self):
+        history = History(self)
+        history.__dict__.update({name: copy.copy(value) for name, value in self.__dict__.items()})
+        return history
 
 class Graph:
     """A class to represent a DAG.
@@ -14,33 +68,89 @@ class Graph:
     evaluated in a topological order. The graph can also have temporary nodes
     and edges. Temporary nodes and edges are used to represent dynamic changes
     in the graph during evaluation. Temporary nodes and edges are cleared after
-    each evaluation. The evaluation processs can also be logged to wandb.
+    each evaluation. Subscribers (see agentkit.hooks.Hooks) are notified of the
+    evaluation events, e.g. to log the evaluation processs to wandb.
+
+    The nodes, edges and orders form the definition of the graph. The state of its evaluations
+    (results, temporary nodes and edges, history) belongs to the ExecutionContext the evaluation
+    runs in, so that several sessions can evaluate the same graph concurrently (see new_context()).
 
     Attributes:
         nodes (dict): A dictionary of all nodes in the graph.
         temporary_nodes (dict): A dictionary of all temporary nodes in the graph.
-        temporary_edges (list): A list of all temporary edges in the graph.
-        temporary_removed_edges (list): A list of all edges that have been temporarily removed.
-        history (dict): A dictionary of all results from the graph.
+        temporary_edges (dict): The temporary (from_key, to_key) edges in the graph, as an insertion-ordered set (values are None).
+        temporary_removed_edges (dict): The (from_key, to_key) edges that have been temporarily removed, as an insertion-ordered set.
+        history (History): A dictionary of all results from the graph.
         num_iter (int): The number of iterations the graph has gone through.
         history_list (list): A list of all results from the graph.
+        incremental (bool): Whether the current evaluation reuses results of nodes whose inputs did not change.
+        worker_pool (WorkerPool): Worker processes that run the LLM queries of the current evaluation, or None.
         order (list): A list of the order in which the nodes were evaluated.
-        queue (list): A list of nodes that need to be evaluated.
-        wandb_root_span (wandb.sdk.data_types.trace_tree.Trace): The root span for wandb logging.
-        chain_span (wandb.sdk.data_types.trace_tree.Trace): The chain span for logging the current step.
+        queue (list): A priority queue (heap) of nodes that are ready to be evaluated.
+        default_latency (float): Latency assumed for nodes without a latency estimate when no node has one.
+        remaining (list): Number of unevaluated dependencies (including orders) of each node, indexed by node id (see compile()).
+        running (set): A set of nodes that are currently being evaluated.
+        timeline (Timeline): Timeline of the current (or last) evaluation.
+        subscribers (list): Hooks objects notified of the events of the graph and of all its nodes.
+        novelty (NoveltyDetector): Detector that lets the evaluations take a fast path when the observation is effectively unchanged (see agentkit.novelty.NoveltyDetector), or None.
     """
+    # state of the evaluations, kept by the current ExecutionContext (see agentkit.context)
+    temporary_nodes = RunState(factory=dict)
+    temporary_edges = RunState(factory=dict)
+    temporary_removed_edges = RunState(factory=dict)
+    history = RunState(factory=History)
+    num_iter = RunState(default=0)
+    history_list = RunState(factory=list)
+    order = RunState(factory=list)
+    queue = RunState(factory=list)
+    remaining = RunState(factory=list)
+    running = RunState(factory=set)
+    timeline = RunState(factory=Timeline)
+    incremental = RunState(default=False)
+    worker_pool = RunState()
+    _undo_log = RunState(factory=list)
+    _state = RunState()
+    _required = RunState()
+    _deadline = RunState()
+    _start_times = RunState(factory=dict)
+    _previous_results = RunState(factory=dict)
+    _refreshing = RunState(factory=dict)
+    _blocking = RunState(factory=set)
+    _recorded = RunState(default=False)
+    _tail = RunState()
+    _prefetched = RunState(factory=dict)
+    _prefetch_timeline = RunState()
+    _priority = RunState()
+    _mean_latency = RunState(default=1.)
+    _prioritize = RunState(default=False)
+    _discovery_counter = RunState(factory=itertools.count)
+    _discovery_order = RunState()
+    _keys = RunState()
+    _nodes = RunState()
+    _temporary_ids = RunState(factory=dict)
+    _extra_successors = RunState(factory=dict)
+    _removed_edges = RunState(factory=set)
+    _lock = RunState(factory=threading.RLock)
+
     def __init__(self):
+        self._own_state = RunValues(type(self))
         self.nodes = {}  # Dictionary to store all nodes
-        self.temporary_nodes = {}
-        self.temporary_edges = []
-        self.temporary_removed_edges = []
-        self.history = {}  # Dictionary to store all results
-        self.num_iter = 0
-        self.history_list = []
-        self.order = []
-        self.queue = []
-        self.wandb_root_span = None
-        self.chain_span = None
+        self._plan = None
+        self.default_latency = 1.
+        self.subscribers = []
+        self.novelty = None
+        self._wandb_tracer = None
+
+    def new_context(self, database=None):
+        """Create a session that evaluates the graph with its own state (see agentkit.context.ExecutionContext).
+
+        Args:
+            database (dict): Database of the session. Defaults to None (the database of each node).
+
+        Returns:
+            ExecutionContext: The new session.
+        """
+        return ExecutionContext(self, database)
     
     def get_node_with_temporary(self, key):
         """Get a node from the graph.
@@ -69,10 +179,12 @@ class Graph:
             node (Node): The node to add to the graph.
         
         Raises:
-            AssertionError: If the node already exists in the graph.
+            AssertionError: If the node already exists in the graph, or if called inside an ExecutionContext.
         """
+        assert current_context() is None, "The permanent graph cannot be modified inside an ExecutionContext"
         assert node.key not in self.nodes.keys(), "Node ({}) already exists".format(node.key)
         self.nodes[node.key] = node
+        self._plan = None
 
     def add_temporary_node(self, node):
         """Add a temporary node to the graph.
@@ -83,9 +195,12 @@ class Graph:
         Raises:
             AssertionError: If the node already exists in the graph.
         """
-        assert node.key not in self.nodes.keys(), "Node ({}) already exists in permanent graph".format(node.key)
-        assert node.key not in self.temporary_nodes.keys(), "Node ({}) already exists in temporary graph".format(node.key)
-        self.temporary_nodes[node.key] = node
+        with self._lock:
+            assert node.key not in self.nodes.keys(), "Node ({}) already exists in permanent graph".format(node.key)
+            assert node.key not in self.temporary_nodes.keys(), "Node ({}) already exists in temporary graph".format(node.key)
+            self.temporary_nodes[node.key] = node
+            if self._state is not None:
+                self._register_temporary_node(node)
         
     def has_edge_with_temporary(self, from_key, to_key):
         """Check if there is an edge between two nodes in the graph.
@@ -115,7 +230,9 @@ class Graph:
         
         Raises:
             ValueError: If the from_key or to_key is not found in the graph.
+            AssertionError: If called inside an ExecutionContext.
         """
+        assert current_context() is None, "The permanent graph cannot be modified inside an ExecutionContext"
         if from_key in self.nodes.keys() and to_key in self.nodes.keys():
             assert not self.has_edge_with_temporary(from_key, to_key), "Edge ({}) already exists".format((from_key, to_key))
             self.nodes[from_key].adjacent_to.append(self.nodes[to_key])
@@ -123,6 +240,7 @@ class Graph:
                 self.nodes[to_key].adjacent_from.insert(0, self.nodes[from_key])
             else:
                 self.nodes[to_key].adjacent_from.append(self.nodes[from_key])
+            self._plan = None
         else:
             raise ValueError("Node ({}, {}) not found in graph".format(from_key, to_key))
     
@@ -140,13 +258,17 @@ class Graph:
         Raises:
             AssertionError: If the from_key or to_key is not found in the graph.
             AssertionError: If the edge already exists between the two nodes.
+            AssertionError: If called inside an ExecutionContext.
         
         Note:
             This function does not add an edge between the two nodes.
         """
+        assert current_context() is None, "The permanent graph cannot be modified inside an ExecutionContext"
         assert from_key in self.nodes.keys() and to_key in self.nodes.keys(), "Node not found in graph"
         assert not self.has_edge_with_temporary(from_key, to_key), "Edge {} already exists. No need to specify order".format((from_key, to_key))
         self.nodes[to_key].evaluate_after.append(self.nodes[from_key])
+        self.nodes[from_key].evaluate_before.append(self.nodes[to_key])
+        self._plan = None
 
     def add_edge_temporary(self, from_key, to_key, prepend=False):
         """Add a temporary edge between two nodes in the graph.
@@ -167,24 +289,28 @@ class Graph:
         Note:
             It is recommended to use temporary edges to represent only dynamic changes in the graph.
         """
-        node_from = self.get_node_with_temporary(from_key)
-        node_to = self.get_node_with_temporary(to_key)
-        assert node_from is not None and node_to is not None, "Node ({}) not found in graph".format(from_key)
-        assert not self.has_edge_with_temporary(from_key, to_key), "Edge ({}) already exists".format((from_key, to_key))
-        node_from.adjacent_to.append(node_to)
-        if prepend:
-            node_to.adjacent_from.insert(0, node_from)
-        else:
-            node_to.adjacent_from.append(node_from)
-        if (from_key, to_key) in self.temporary_removed_edges:
-            self.temporary_removed_edges.remove((from_key, to_key))
-        else:
-            self.temporary_edges.append((from_key, to_key))
+        with self._lock:
+            node_from = self.get_node_with_temporary(from_key)
+            node_to = self.get_node_with_temporary(to_key)
+            assert node_from is not None and node_to is not None, "Node ({}) not found in graph".format(from_key)
+            assert not self.has_edge_with_temporary(from_key, to_key), "Edge ({}) already exists".format((from_key, to_key))
+            assert to_key not in self.running, "Cannot add edge to a node ({}) that is being evaluated".format(to_key)
+            self._log_adjacency(node_from.adjacent_to, node_to)
+            self._log_adjacency(node_to.adjacent_from, node_from, reorder=prepend)
+            node_from.adjacent_to.append(node_to)
+            if prepend:
+                node_to.adjacent_from.insert(0, node_from)
+            else:
+                node_to.adjacent_from.append(node_from)
+            if (from_key, to_key) in self.temporary_removed_edges:
+                del self.temporary_removed_edges[(from_key, to_key)]
+            else:
+                self.temporary_edges[(from_key, to_key)] = None
+
+            assert to_key not in self.history.keys(), "Cannot add edge to a node ({}) that has already been evaluated".format(to_key)
+            if self._state is not None:
+                self._temporary_edge_added(from_key, to_key)
 
-        assert to_key not in self.history.keys(), "Cannot add edge to a node ({}) that has already been evaluated".format(to_key)
-        if from_key in self.history.keys() and to_key not in self.queue: # if from_key has been evaluated, add to queue
-            self.queue.append(to_key)
-        
 
     def remove_edge_temporary(self, from_key, to_key):
         """Remove a temporary edge between two nodes in the graph.
@@ -203,18 +329,24 @@ class Graph:
         Note:
             It is recommended to use this function only for dynamic changes in the graph.
         """
-        assert self.has_edge_with_temporary(from_key, to_key), "Edge does not exist"
-        node_from = self.get_node_with_temporary(from_key)
-        node_to = self.get_node_with_temporary(to_key)
-        node_from.adjacent_to.remove(node_to)
-        node_to.adjacent_from.remove(node_from)
-        if (from_key, to_key) in self.temporary_edges:
-            self.temporary_edges.remove((from_key, to_key))
-        else:
-            self.temporary_removed_edges.append((from_key, to_key))
+        with self._lock:
+            assert self.has_edge_with_temporary(from_key, to_key), "Edge does not exist"
+            assert to_key not in self.running, "Cannot remove edge to a node ({}) that is being evaluated".format(to_key)
+            node_from = self.get_node_with_temporary(from_key)
+            node_to = self.get_node_with_temporary(to_key)
+            self._log_adjacency(node_from.adjacent_to, node_to)
+            self._log_adjacency(node_to.adjacent_from, node_from)
+            node_from.adjacent_to.remove(node_to)
+            node_to.adjacent_from.remove(node_from)
+            if (from_key, to_key) in self.temporary_edges:
+                del self.temporary_edges[(from_key, to_key)]
+            else:
+                self.temporary_removed_edges[(from_key, to_key)] = None
 
-        assert to_key not in self.history.keys(), "Cannot remove edge to a node ({}) that has already been evaluated".format(to_key)
-        assert from_key not in self.history.keys(), "Cannot remove edge from a node ({}) that has already been evaluated".format(from_key)
+            assert to_key not in self.history.keys(), "Cannot remove edge to a node ({}) that has already been evaluated".format(to_key)
+            assert from_key not in self.history.keys(), "Cannot remove edge from a node ({}) that has already been evaluated".format(from_key)
+            if self._state is not None:
+                self._temporary_edge_removed(from_key, to_key)
 
     def skip_nodes_temporary(self, keys):
         """Skip nodes temporarily in the graph.
@@ -233,102 +365,866 @@ class Graph:
         Note:
             It is recommended to use this function only for dynamic changes in the graph.
         """
-        for key in keys:
-            node = self.get_node_with_temporary(key)
-            # assert node is not temporary
-            assert key not in self.temporary_nodes.keys(), "Cannot skip temporary node: {}".format(key)
-            assert key not in self.history.keys(), "Cannot skip node {}. It has already been evaluated.".format(key)
-            node.skip_turn()
+        with self._lock:
+            for key in keys:
+                node = self.get_node_with_temporary(key)
+                # assert node is not temporary
+                assert key not in self.temporary_nodes.keys(), "Cannot skip temporary node: {}".format(key)
+                assert key not in self.history.keys(), "Cannot skip node {}. It has already been evaluated.".format(key)
+                assert key not in self.running, "Cannot skip node {}. It is being evaluated.".format(key)
+                node.skip_turn()
+
+    def _log_adjacency(self, nodes, node, reorder=False):
+        # record the state of node in an adjacency list before a temporary change, or the whole list if the change reorders it
+        if reorder:
+            self._undo_log.append((nodes, None, nodes._copy_state()))
+        else:
+            self._undo_log.append((nodes, node, nodes._state(node)))
 
     def clean_temporary(self):
-        for from_key, to_key in self.temporary_edges:
-            node_from = self.get_node_with_temporary(from_key)
-            node_to = self.get_node_with_temporary(to_key)
-            node_from.adjacent_to.remove(node_to)
-            node_to.adjacent_from.remove(node_from)
-        for from_key, to_key in self.temporary_removed_edges:
-            node_from = self.get_node_with_temporary(from_key)
-            node_to = self.get_node_with_temporary(to_key)
-            node_from.adjacent_to.append(node_to)
-            node_to.adjacent_from.append(node_from)
+        """Revert all temporary changes to the graph.
+
+        Temporary changes to the adjacency of nodes are rolled back from an undo log, in O(number of changes).
+        Adjacency lists get back their original order, including when a temporarily removed edge was added
+        back with prepend=True.
+        In an ExecutionContext, the state that the context kept for the temporary nodes is dropped.
+        """
+        for nodes, node, state in reversed(self._undo_log):
+            if node is None:
+                nodes._restore_state(state)
+            else:
+                nodes._set_state(node, state)
+        self._undo_log = []
+        context = current_context()
+        if context is not None: # temporary nodes are created at every step, their state must not pile up in the session
+            for node in self.temporary_nodes.values():
+                context._forget(node)
         self.temporary_nodes = {}
-        self.temporary_edges = []
-        self.temporary_removed_edges = []
+        self.temporary_edges = {}
+        self.temporary_removed_edges = {}
     
-    def set_wandb_root_span(self, span):
-        self.wandb_root_span = span
-    
-    def set_trace(self):
-        if self.wandb_root_span is None:
-            return
-        chain_span = Trace(
-            "GraphChain",
-            kind="chain",
-            start_time_ms=round(datetime.datetime.now().timestamp() * 1000),
-            metadata={"num_iter": self.num_iter},
-        )
-        self.chain_span = chain_span
-
-    def commit_trace(self):
-        if self.chain_span is None:
-            return
-        self.chain_span._span.end_time_ms = round(datetime.datetime.now().timestamp() * 1000)
-        self.chain_span.add_inputs_and_outputs(inputs={}, 
-                                               outputs={"response": self.history})
-        self.wandb_root_span.add_child(self.chain_span)
-        self.chain_span = None
+    def subscribe(self, subscriber):
+        """Subscribe to the events of the graph and of all its nodes.
+
+        Args:
+            subscriber (Hooks): The subscriber.
+        """
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber.
+
+        Args:
+            subscriber (Hooks): The subscriber.
+        """
+        self.subscribers.remove(subscriber)
+
+    def _emit(self, event, *args):
+        for subscriber in self.subscribers:
+            getattr(subscriber, event)(*args)
+
+    def set_wandb_root_span(self, span, sample_rate=1.):
+        """Log the evaluations to wandb under a root span (see agentkit.wandb_tracer.WandbTracer).
+
+        Args:
+            span (wandb.sdk.data_types.trace_tree.Trace): The root span.
+            sample_rate (float): Fraction of the evaluations that are logged.
+        """
+        if self._wandb_tracer is None:
+            from .wandb_tracer import WandbTracer
+            self._wandb_tracer = WandbTracer(span, sample_rate=sample_rate)
+            self.subscribe(self._wandb_tracer)
+        self._wandb_tracer.root_span = span
+        self._wandb_tracer.sample_rate = sample_rate
     
     def get_streaming_history(self):
         assert len(self.history) == 0, "Error: This function should only be called before evaluate() is called."
         return self.history
 
-    def evaluate(self):
-        """Evaluate the graph in a topological order.
+    def compile(self):
+        """Compile the permanent graph into an execution plan.
 
-        This function evaluates the graph in a topological order. The order of evaluation
-        is determined by the dependencies between the nodes. The graph can also have temporary
-        nodes and edges. Temporary nodes and edges are used to represent dynamic changes in the
-        graph during evaluation. Temporary nodes and edges are cleared after each evaluation.
+        The plan freezes the permanent topology into integer-indexed arrays (see ExecutionPlan).
+        It is reused by every evaluation until a node, edge or order is added to the permanent
+        graph, so an evaluation without temporary modifications does no graph analysis.
+        evaluate() compiles the graph automatically when needed.
 
         Returns:
-            dict: A dictionary of the results from the graph.
+            ExecutionPlan: The compiled plan.
 
         Raises:
-            AssertionError: If the temporary nodes are not cleared before calling evaluate().
+            ValueError: If the graph contains a cycle.
         """
-        
-        def recalculate_in_degree(key):
-            node = self.get_node_with_temporary(key)
-            return len([n for n in node.get_dependencies_inc_order() if n.key not in self.history.keys()]) 
-        
-        def find_next_node(queue):
-            for key in queue:
-                degree = recalculate_in_degree(key)
-                if degree == 0:
-                    return key
+        with self._lock:
+            temporary_edges = set(self.temporary_edges)
+            edges = [(key, n.key) for key, node in self.nodes.items() for n in node.adjacent_to if (key, n.key) not in temporary_edges]
+            edges += list(self.temporary_removed_edges)
+            orders = [(n.key, key) for key, node in self.nodes.items() for n in node.evaluate_after]
+            self._plan = ExecutionPlan(self.nodes, edges, orders)
+            return self._plan
+
+    def _node_id(self, key):
+        if key in self._plan.index:
+            return self._plan.index[key]
+        return self._temporary_ids[key]
+
+    def _register_temporary_node(self, node):
+        self._temporary_ids[node.key] = len(self._keys)
+        self._keys.append(node.key)
+        self._nodes.append(node)
+        self.remaining.append(0)
+        self._state.append(_UNDISCOVERED)
+        self._discovery_order.append(None)
+        if self._required is not None:
+            self._required.append(False)
+        elif not node.deferred:
+            self._blocking.add(self._temporary_ids[node.key])
+        if self._prioritize:
+            self._priority.append(self._node_cost(node))
+
+    def _temporary_edge_added(self, from_key, to_key):
+        i, j = self._node_id(from_key), self._node_id(to_key)
+        if (i, j) in self._removed_edges:
+            self._removed_edges.discard((i, j))
+        else:
+            self._extra_successors.setdefault(i, []).append(j)
+        if from_key not in self.history.keys():
+            self.remaining[j] += 1
+        else: # if from_key has been evaluated, add to queue
+            self._discover(j)
+        if self._required is not None and self._required[j]:
+            self._require([i])
+
+    def _temporary_edge_removed(self, from_key, to_key):
+        i, j = self._node_id(from_key), self._node_id(to_key)
+        if j in self._extra_successors.get(i, []):
+            self._extra_successors[i].remove(j)
+        else:
+            self._removed_edges.add((i, j))
+        self.remaining[j] -= 1
+        self._push_if_ready(j)
+
+    def _discover(self, i, cause=None):
+        """Start tracking a node, making it eligible to be evaluated once its dependencies are."""
+        run = run_state(self)
+        if run._state[i] != _UNDISCOVERED:
+            return
+        run._state[i] = _DISCOVERED
+        run._discovery_order[i] = next(run._discovery_counter)
+        if run._prioritize and i >= len(self._plan.keys): # temporary node
+            run._priority[i] = self._node_cost(run._nodes[i]) + max([run._priority[j] for j in run._extra_successors.get(i, [])], default=0.)
+        self._push_if_ready(i, cause)
+
+    def _require(self, ids):
+        """Mark nodes and all their ancestors (dependencies and orders) as needed by the targets."""
+        stack = list(ids)
+        while len(stack) > 0:
+            i = stack.pop()
+            if self._required[i]:
+                continue
+            self._required[i] = True
+            if not self._nodes[i].deferred:
+                self._blocking.add(i)
+            stack += [self._node_id(n.key) for n in self._nodes[i].get_dependencies_inc_order()]
+            self._push_if_ready(i)
+
+    def _push_if_ready(self, i, cause=None):
+        run = run_state(self)
+        if run._required is not None and not run._required[i]:
+            return
+        if run._state[i] == _DISCOVERED and run.remaining[i] == 0:
+            run.timeline.record(run._keys[i], "ready", cause)
+            # deferred nodes come last, so that the evaluation can return once the other nodes complete (see _defer_tail());
+            # ties (and all nodes in serial mode) are broken by the order in which nodes were discovered, not by when they became ready
+            rank = (run._nodes[i].deferred, -run._priority[i] if run._prioritize else 0., run._discovery_order[i])
+            heapq.heappush(run.queue, (rank, i))
+
+    def _successors(self, i):
+        run = run_state(self)
+        if i < len(self._plan.keys):
+            successors = self._plan.successors[i]
+            if len(run._removed_edges) > 0:
+                successors = [j for j in successors if (i, j) not in run._removed_edges]
+            return successors + run._extra_successors.get(i, [])
+        return run._extra_successors.get(i, [])
+
+    def _next_ready_node(self):
+        """Pop the next node whose dependencies and orders are all evaluated.
+
+        Returns:
+            str: The key of the node, or None if no node is ready.
+        """
+        run = run_state(self)
+        while len(run.queue) > 0:
+            _, i = heapq.heappop(run.queue)
+            # entries become stale if a temporary edge was added after the node became ready
+            if run._state[i] == _DISCOVERED and run.remaining[i] == 0:
+                run._state[i] = _DISPATCHED
+                key = run._keys[i]
+                run._start_times[key] = time.time()
+                run.timeline.record(key, "start")
+                run._nodes[i]._emit("on_node_start", run._nodes[i])
+                run._previous_results[key] = run._nodes[i].result
+                self._open_view(i)
+                run.order.append(key)
+                run.running.add(key)
+                return key
+        return None
+
+    def _pending(self, key):
+        # whether a permanent node has not completed in the current evaluation, and is needed by it
+        i = self._plan.index.get(key) if self._plan is not None else None
+        if i is None or self._state is None or (self._state[i] == _DISPATCHED and key not in self.running):
+            return False
+        return self._required is None or self._required[i]
+
+    def _open_view(self, i):
+        # nodes evaluated on a Database read and write a private copy of it until they complete
+        node = self._nodes[i]
+        database = getattr(node, "db", None)
+        if isinstance(database, DatabaseView): # e.g. a temporary node given the view of the node that added it
+            database = database.database
+        if isinstance(database, Database):
+            node.db = database.view(node.key, self._rank(i))
+
+    def _close_view(self, node, commit):
+        view = getattr(node, "db", None)
+        if isinstance(view, DatabaseView):
+            node.db = view.database
+            if commit:
+                self.history.conflicts += view.database.commit(view)
+            else:
+                view.database.discard(view)
+
+    def _rank(self, i):
+        # position of a node in the serial order that the writes to a Database follow
+        if i < len(self._plan.keys):
+            return (self._plan.ranks[i], self._keys[i])
+        node = self._nodes[i]
+        rank = max((self._rank(self._node_id(dependency.key))[0] for dependency in node.get_dependencies_inc_order()), default=-1)
+        return (rank + .5, node.key)
+
+    def _complete_node(self, key, result, commit=True):
+        """Record the result of a node and release its successors.
+
+        Args:
+            key (str): The key of the node.
+            result (Any): The result of the node.
+            commit (bool): Whether to commit the writes of the node to its Database.
+
+        Returns:
+            tuple: (key, result, timing) of the node.
+        """
+        run = run_state(self)
+        end = time.time()
+        run.timeline.record(key, "end")
+        run.running.discard(key)
+        run.history[key] = result
+        i = self._node_id(key)
+        run._blocking.discard(i)
+        node = run._nodes[i]
+        self._close_view(node, commit)
+        node._emit("on_node_end", node, result)
+        if node.reused:
+            run.history.reused.add(key)
+        for j in self._successors(i):
+            run.remaining[j] -= 1
+            if run._state[j] == _UNDISCOVERED:
+                self._discover(j, key)
+            else:
+                self._push_if_ready(j, key)
+        if i < len(self._plan.keys):
+            for j in self._plan.order_successors[i]:
+                run.remaining[j] -= 1
+                self._push_if_ready(j, key)
+        return key, result, NodeTiming(run._start_times.pop(key), end, node._llm_time)
+
+    def _fallback_result(self, key):
+        node = self.get_node_with_temporary(key)
+        result = self._previous_results.get(key, node.result)
+        if result is None:
+            result = node.default_result
+        return result
+
+    def _fall_back(self, key, result=None):
+        node = self.get_node_with_temporary(key)
+        node.result = self._fallback_result(key) if result is None else result
+        node.temporary_skip = False
+        node.reused = False
+        node._llm_time = 0.
+        return self._complete_node(key, node.result, commit=False)
+
+    def _degrade_node(self, key):
+        """Give up on evaluating a node, falling back to its previous result or its default_result.
+
+        Returns:
+            tuple: (key, result, timing) of the node.
+        """
+        self.history.degraded.add(key)
+        return self._fall_back(key)
+
+    def _fail_node(self, key, error):
+        """Mark a node as failed, falling back to its previous result or its default_result.
+
+        Returns:
+            tuple: (key, result, timing) of the node.
+
+        Raises:
+            LLMQueryError: If the node has no result to fall back to.
+        """
+        if self._deadline_passed(): # its queries were cut short by the deadline (see BaseNode.timeout)
+            return self._degrade_node(key)
+        if self._fallback_result(key) is None:
+            raise error
+        self.history.failed[key] = error
+        return self._fall_back(key)
+
+    def _complete_without_evaluation(self, key):
+        """Complete a dispatched node that does not need to be evaluated.
+
+        Returns:
+            tuple: (key, result, timing) of the node, or None if the node has to be evaluated.
+        """
+        run = run_state(self)
+        if key in run._prefetched:
+            run.history.prefetched.add(key)
+            return self._complete_node(key, run._prefetched.pop(key))
+        completed = self._complete_if_unneeded(key)
+        if completed is not None:
+            return completed
+        if self._is_stale(key):
+            return self._serve_stale(key)
+        if self._deadline_passed():
+            return self._degrade_node(key)
+        return None
+
+    def _complete_if_unneeded(self, key):
+        """Complete a dispatched node that is not due (see BaseNode.schedule) or whose condition is false.
+
+        Returns:
+            tuple: (key, result, timing) of the node, or None if the node has to be evaluated.
+        """
+        if self._is_off_path(key):
+            self.history.cached.add(key)
+            self.novelty._saved(key)
+            return self._fall_back(key, self.nodes[key].result)
+        if self._is_off_cycle(key):
+            self.history.cached.add(key)
+            return self._fall_back(key, self.get_node_with_temporary(key).result)
+        if self._is_gated(key):
+            return self._gate_node(key)
+        return None
+
+    def _is_off_path(self, key):
+        # nodes outside of the fast path of a fast evaluation reuse their cached result
+        return (self.history.fast and key in self.nodes and key not in self.novelty.fast_path
+                and self.nodes[key].result is not None)
+
+    def _is_off_cycle(self, key):
+        node = self.get_node_with_temporary(key)
+        if node.schedule is None:
+            return False
+        if node.result is not None and not node.schedule.due(node, self.num_iter):
+            return True
+        node.schedule.evaluated(node, self.num_iter)
+        return False
+
+    def _is_gated(self, key):
+        node = self.get_node_with_temporary(key)
+        return node.condition is not None and not node.condition(node)
+
+    def _gate_node(self, key):
+        """Complete a node whose condition is false without querying the LLM.
+
+        The prompt is still composed, so that the dependents of the node see its rendered prompt as usual.
+        The result is the gated_result of the node, or its previous result, or its default_result, or an
+        empty string if it has none, so that the dependents are composed from a string either way.
+
+        Returns:
+            tuple: (key, result, timing) of the node.
+        """
+        node = self.get_node_with_temporary(key)
+        self.history.gated.add(key)
+        self.timeline.record(key, "compose_start")
+        node.compose_prompt()
+        self.timeline.record(key, "compose_end")
+        result = node.gated_result
+        if result is None:
+            result = self._fallback_result(key)
+        return self._fall_back(key, "" if result is None else result)
+
+    def _is_stale(self, key):
+        node = self.get_node_with_temporary(key)
+        return node.stale_while_revalidate and key in self.nodes and node.result is not None
+
+    def _serve_stale(self, key):
+        """Complete a stale_while_revalidate node with its last result, and refresh it in the background.
+
+        The prompt is composed now, and the LLM is queried in a background thread. The answer and
+        the side effects of the AfterQuery are applied at the beginning of a later evaluation (see
+        _apply_refreshes()). While a refresh is running, the node is not refreshed again.
+
+        Returns:
+            tuple: (key, result, timing) of the node.
+        """
+        node = self.nodes[key]
+        if key not in self._refreshing and node._start_refresh():
+            self._refreshing[key] = node
+        if key in self._refreshing:
+            self.history.stale.add(key)
+        return self._complete_node(key, node.result)
+
+    def _apply_refreshes(self):
+        # called at the iteration boundary, in the thread that evaluates the graph
+        for key, node in list(self._refreshing.items()):
+            try:
+                finished = node._finish_refresh()
+            except LLMQueryError as e: # keep the stale result
+                self.history.failed[key] = e
+                finished = True
+            if finished:
+                del self._refreshing[key]
+
+    def _time_left(self):
+        if self._deadline is None:
             return None
-        
+        return max(0., self._deadline - time.monotonic())
+
+    def _deadline_passed(self):
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def _node_cost(self, node):
+        if node.latency is not None:
+            return node.latency
+        return self._mean_latency
+
+    def compute_priorities(self):
+        """Compute the critical-path priority of every node in the permanent graph.
+
+        The priority of a node is its latency estimate plus the largest priority among the nodes
+        that depend on it (edges or orders), i.e. the estimated latency of the longest remaining
+        path. Nodes without a latency estimate are assumed to take the mean latency of the others.
+
+        Returns:
+            dict: A dictionary of the priorities of the nodes.
+        """
+        if self._plan is None:
+            self.compile()
+        plan = self._plan
+        known = [node.latency for node in plan.nodes if node.latency is not None]
+        self._mean_latency = sum(known) / len(known) if len(known) > 0 else self.default_latency
+        priority = [0.] * len(plan.keys)
+        for i in reversed(plan.topological_order()):
+            priority[i] = self._node_cost(plan.nodes[i]) + max([priority[j] for j in plan.successors[i] + plan.order_successors[i]], default=0.)
+        self._priority = priority
+        return dict(zip(plan.keys, priority))
+
+    def _begin_evaluation(self, prioritize=False, incremental=False, targets=None, deadline=None, worker_pool=None):
+        self.join()
         assert len(self.temporary_nodes) == 0, "Temporary nodes must be cleared before calling evaluate()"
-        in_degree = {key: len(self.nodes[key].adjacent_from) for key in self.nodes.keys()}
-        self.queue = [key for key in in_degree.keys() if in_degree[key] == 0]
+        self._deadline = time.monotonic() + deadline if deadline is not None else None
+        for key in targets or []:
+            assert key in self.nodes.keys(), "Target node ({}) not found in graph".format(key)
+        if self._plan is None:
+            self.compile()
+        plan = self._plan
+        self.incremental = incremental
+        self.worker_pool = worker_pool
+        self.timeline = self._prefetch_timeline or Timeline() # prefetched nodes have recorded their events already
+        self._prefetch_timeline = None
+        self.history.timeline = self.timeline
+        self._apply_refreshes()
+        if self.novelty is not None:
+            self.history.novelty, self.history.fast = self.novelty._begin(self)
+        self.queue = []
         self.order = []
-        self.set_trace()
+        self.running = set()
+        self._start_times = {}
+        self._previous_results = {}
+        self._prioritize = prioritize
+        if prioritize:
+            self.compute_priorities()
+        self._keys = list(plan.keys)
+        self._nodes = list(plan.nodes)
+        self._temporary_ids = {}
+        self._extra_successors = {}
+        self._removed_edges = set()
+        self.remaining = list(plan.dep_counts)
+        self._state = [_UNDISCOVERED] * len(plan.keys)
+        self._discovery_order = [None] * len(plan.keys)
+        self._required = None
+        self._blocking = set()
+        self._recorded = False
+        if targets is not None:
+            self._required = [False] * len(plan.keys)
+            self._require([plan.index[key] for key in targets])
+        else:
+            self._blocking = set(i for i, node in enumerate(plan.nodes) if not node.deferred)
+        roots = plan.roots
+        if len(self.temporary_edges) > 0 or len(self.temporary_removed_edges) > 0: # temporary edges added before evaluation
+            for from_key, to_key in self.temporary_edges:
+                self._extra_successors.setdefault(plan.index[from_key], []).append(plan.index[to_key])
+                self.remaining[plan.index[to_key]] += 1
+            for from_key, to_key in self.temporary_removed_edges:
+                self._removed_edges.add((plan.index[from_key], plan.index[to_key]))
+                self.remaining[plan.index[to_key]] -= 1
+            roots = [i for i, node in enumerate(plan.nodes) if len(node.adjacent_from) == 0]
+        self._emit("on_graph_start", self)
+        for i in roots:
+            self._discover(i)
+
+    def _end_evaluation(self):
+        if self._required is not None:
+            for key, node in self.nodes.items():
+                if key not in self.history.keys():
+                    self.history[key] = node.result
+                    self.history.skipped.add(key)
+                    node.temporary_skip = False
+        if not self._recorded:
+            self.num_iter += 1
+            self.history_list.append(self.history.copy())
+        self._emit("on_graph_end", self, self.history_list[-1])
+        self.history = History()
+        self.order = []
+        self.queue = []
+        self.remaining = []
+        self.running = set()
+        self._state = None
+        self._prefetched = {}
+        self.clean_temporary()
+        return self.history_list[-1]
+
+    def _evaluate_serial(self):
         while True:
-            node_key = find_next_node(self.queue)
+            node_key = self._next_ready_node()
             if node_key is None:
                 break
-            self.queue.remove(node_key)
-            self.order.append(node_key)
+            completion = self._complete_without_evaluation(node_key)
+            if completion is not None:
+                yield completion
+                continue
             node = self.get_node_with_temporary(node_key)
-            self.history[node_key] = node.evaluate() # this may change the graph
-            for adjacent in node.adjacent_to:
-                if adjacent.key not in self.history.keys() and adjacent.key not in self.queue:
-                    self.queue.append(adjacent.key)
+            try:
+                result = node.evaluate() # this may change the graph
+            except LLMQueryError as e:
+                yield self._fail_node(node_key, e)
+                continue
+            yield self._complete_node(node_key, result)
+
+    def _evaluate_threaded(self, max_workers):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        abandoned = False
+        try:
+            while True:
+                completed = []
+                with self._lock:
+                    while len(futures) < max_workers:
+                        node_key = self._next_ready_node()
+                        if node_key is None:
+                            break
+                        completion = self._complete_without_evaluation(node_key)
+                        if completion is not None:
+                            completed.append(completion)
+                            continue
+                        node = self.get_node_with_temporary(node_key)
+                        futures[executor.submit(contextvars.copy_context().run, node.evaluate)] = node_key # this may change the graph
+                yield from completed
+                if len(completed) > 0:
+                    continue
+                if len(futures) == 0:
+                    break
+                done, _ = wait(futures.keys(), timeout=self._time_left(), return_when=FIRST_COMPLETED)
+                with self._lock:
+                    for future in done:
+                        node_key = futures.pop(future)
+                        try:
+                            completed.append(self._complete_node(node_key, future.result()))
+                        except LLMQueryError as e:
+                            completed.append(self._fail_node(node_key, e))
+                    if len(done) == 0 and self._deadline_passed():
+                        # running threads cannot be cancelled: nodes in flight are degraded, and their threads
+                        # stop at their next LLM reply (see BaseNode._run), which the deadline does not wait for
+                        for node_key in futures.values():
+                            completed.append(self._degrade_node(node_key))
+                        futures = {}
+                        abandoned = True
+                yield from completed
+        finally:
+            executor.shutdown(wait=not abandoned)
+
+    async def _aevaluate_nodes(self, max_concurrency, executor):
+        tasks = {}
+        try:
+            while True:
+                while max_concurrency is None or len(tasks) < max_concurrency:
+                    node_key = self._next_ready_node()
+                    if node_key is None:
+                        break
+                    completion = self._complete_without_evaluation(node_key)
+                    if completion is not None:
+                        yield completion
+                        continue
+                    node = self.get_node_with_temporary(node_key)
+                    tasks[asyncio.ensure_future(node.aevaluate(executor=executor))] = node_key # this may change the graph
+                if len(tasks) == 0:
+                    break
+                done, _ = await asyncio.wait(tasks.keys(), timeout=self._time_left(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node_key = tasks.pop(task)
+                    try:
+                        result = task.result()
+                    except LLMQueryError as e:
+                        yield self._fail_node(node_key, e)
+                        continue
+                    yield self._complete_node(node_key, result)
+                if len(done) == 0 and self._deadline_passed(): # cancel nodes in flight
+                    for task in tasks.keys():
+                        task.cancel()
+                    await asyncio.gather(*tasks.keys(), return_exceptions=True)
+                    cancelled, tasks = tasks, {}
+                    for node_key in cancelled.values():
+                        yield self._degrade_node(node_key)
+        finally:
+            for task in tasks.keys():
+                task.cancel()
+
+    def _defer_tail(self):
+        """Record the evaluation while its deferred nodes are still running.
+
+        The recorded History is completed in place by the deferred nodes.
+
+        Returns:
+            bool: Whether any deferred node is left to evaluate.
+        """
+        self.history.deferred = set(key for i, key in enumerate(self._keys)
+                                    if self._nodes[i].deferred and key not in self.history
+                                    and (self._required is None or self._required[i]))
+        if len(self.history.deferred) == 0:
+            return False
         self.num_iter += 1
-        self.commit_trace()
-        self.history_list.append(self.history.copy())
-        self.history = {}
+        self.history_list.append(self.history)
+        self._recorded = True
+        return True
+
+    def _end_tail(self):
+        for key in self.history.deferred:
+            if key not in self.history: # interrupted before the deferred node completed
+                self.history[key] = self._fallback_result(key)
+                self.history.degraded.add(key)
+        self._end_evaluation()
+
+    def _run_tail(self, evaluation):
+        try:
+            for _ in evaluation:
+                pass
+        finally:
+            with self._lock: # see Pipeline
+                self._end_tail()
+
+    async def _arun_tail(self, evaluation, executor):
+        try:
+            async for _ in evaluation:
+                pass
+        finally:
+            self._end_tail()
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def join(self):
+        """Wait for the deferred nodes of the last evaluation to complete.
+
+        Called by every evaluation before it starts.
+
+        Raises:
+            RuntimeError: If the deferred nodes are running on an event loop (use ajoin() instead).
+        """
+        tail = self._tail
+        if tail is None:
+            return
+        if isinstance(tail, asyncio.Future) and not tail.done():
+            raise RuntimeError("The deferred nodes of the last evaluation are running on an event loop. Use ajoin() instead.")
+        self._tail = None
+        if not tail.cancelled():
+            tail.result()
+
+    async def ajoin(self):
+        """Wait for the deferred nodes of the last evaluation to complete, on the running event loop."""
+        tail = self._tail
+        if tail is None:
+            return
+        if not isinstance(tail, asyncio.Future):
+            tail = asyncio.wrap_future(tail)
+        elif not tail.done():
+            await asyncio.wait([tail])
+        self._tail = None
+        if not tail.cancelled():
+            await tail
+
+    def _abort_evaluation(self):
+        for key in self.running:
+            self._close_view(self.get_node_with_temporary(key), False)
+        self._prefetched = {}
+        self.history = History()
         self.order = []
         self.queue = []
+        self.remaining = []
+        self.running = set()
+        self._state = None
         self.clean_temporary()
+
+    async def aevaluate_iter(self, max_concurrency=None, executor=None, max_executor_workers=8, incremental=False, targets=None, deadline=None, worker_pool=None):
+        """Evaluate the graph on the running event loop, yielding node results as they complete.
+
+        Same as aevaluate(), but as an async generator. The evaluation is recorded once the iterator
+        is exhausted; closing it early aborts the evaluation and reverts temporary modifications.
+
+        Yields:
+            tuple: (key, result, timing) of each evaluated node, where timing is a NodeTiming.
+        """
+        await self.ajoin()
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_executor_workers)
+        self._begin_evaluation(prioritize=True, incremental=incremental, targets=targets, deadline=deadline, worker_pool=worker_pool)
+        evaluation = self._aevaluate_nodes(max_concurrency, executor)
+        finished = False
+        try:
+            while len(self._blocking) > 0:
+                try:
+                    item = await evaluation.__anext__()
+                except StopAsyncIteration:
+                    break
+                yield item
+            if self._defer_tail(): # the deferred nodes run as a task on the event loop
+                self._tail = asyncio.ensure_future(self._arun_tail(evaluation, executor if own_executor else None))
+            else:
+                async for item in evaluation:
+                    yield item
+            finished = True
+        finally:
+            if self._tail is None:
+                if own_executor:
+                    executor.shutdown(wait=False)
+                if finished:
+                    self._end_evaluation()
+                else:
+                    await evaluation.aclose()
+                    self._abort_evaluation()
+
+    async def aevaluate(self, max_concurrency=None, executor=None, max_executor_workers=8, incremental=False, targets=None, deadline=None, worker_pool=None):
+        """Evaluate the graph on the running event loop.
+
+        Every node whose dependencies and orders are satisfied is evaluated concurrently
+        as a coroutine (see BaseNode.aevaluate). query_llm may be an async callable;
+        synchronous callables are bridged through a bounded thread pool executor.
+        Nodes on the longest remaining path (see compute_priorities) are started first.
+
+        Args:
+            max_concurrency (int): Maximum number of nodes in flight. Defaults to None (no limit).
+            executor (concurrent.futures.Executor): Executor for synchronous query_llm callables. Can be shared across graphs. Defaults to None (a private executor is created for this evaluation).
+            max_executor_workers (int): Number of workers of the private executor.
+            incremental (bool): Reuse the previous result of nodes whose composed prompt did not change (see evaluate()).
+            targets (list): Keys of the nodes to evaluate, together with their ancestors (see evaluate()). Defaults to None (all nodes).
+            deadline (float): Time budget of the evaluation in seconds (see evaluate()). Nodes in flight at the deadline are cancelled and degraded. Defaults to None (no deadline).
+            worker_pool (WorkerPool): Worker processes to run the LLM queries in (see evaluate()). Defaults to None (queries run in this process).
+
+        Returns:
+            History: A dictionary of the results from the graph.
+
+        Raises:
+            AssertionError: If the temporary nodes are not cleared before calling aevaluate().
+        """
+        async for _ in self.aevaluate_iter(max_concurrency=max_concurrency, executor=executor, max_executor_workers=max_executor_workers, incremental=incremental, targets=targets, deadline=deadline, worker_pool=worker_pool):
+            pass
+        return self.history_list[-1]
+
+    def evaluate_iter(self, max_workers=None, incremental=False, targets=None, deadline=None, worker_pool=None):
+        """Evaluate the graph, yielding node results as they complete.
+
+        Same as evaluate(), but as a generator, so that callers can act on a result (e.g. the
+        action) as soon as its node completes. The evaluation is recorded once the iterator is
+        exhausted; closing it early aborts the evaluation and reverts temporary modifications.
+
+        Args:
+            max_workers (int): Number of nodes to evaluate concurrently. Defaults to None (serial evaluation).
+            incremental (bool): Reuse the previous result of nodes whose composed prompt did not change.
+            targets (list): Keys of the nodes to evaluate, together with their ancestors. Defaults to None (all nodes).
+            deadline (float): Time budget of the evaluation in seconds. Defaults to None (no deadline).
+            worker_pool (WorkerPool): Worker processes to run the LLM queries in. Defaults to None (queries run in this process).
+
+        Yields:
+            tuple: (key, result, timing) of each evaluated node, where timing is a NodeTiming.
+        """
+        concurrent = max_workers is not None and max_workers > 1
+        self._begin_evaluation(prioritize=concurrent, incremental=incremental, targets=targets, deadline=deadline, worker_pool=worker_pool)
+        evaluation = self._evaluate_threaded(max_workers) if concurrent else self._evaluate_serial()
+        finished = False
+        try:
+            while len(self._blocking) > 0:
+                item = next(evaluation, None)
+                if item is None:
+                    break
+                yield item
+            if self._defer_tail(): # the deferred nodes run in a background thread
+                self._tail = call_in_thread(self._run_tail, evaluation)
+            else:
+                yield from evaluation
+            finished = True
+        finally:
+            if self._tail is None:
+                if finished:
+                    self._end_evaluation()
+                else:
+                    evaluation.close()
+                    self._abort_evaluation()
+
+    def evaluate(self, max_workers=None, incremental=False, targets=None, deadline=None, worker_pool=None):
+        """Evaluate the graph in a topological order.
+
+        This function evaluates the graph in a topological order. The order of evaluation
+        is determined by the dependencies between the nodes. The graph can also have temporary
+        nodes and edges. Temporary nodes and edges are used to represent dynamic changes in the
+        graph during evaluation. Temporary nodes and edges are cleared after each evaluation.
+
+        If max_workers is set, every node whose dependencies and orders are satisfied is
+        dispatched to a thread pool, so independent nodes query the LLM concurrently.
+        Temporary modifications made by after-query functions are applied under a lock
+        and take effect for nodes that have not been dispatched yet. When more nodes are ready
+        than there are workers, nodes on the longest remaining path (see compute_priorities)
+        are dispatched first.
+
+        How each node is evaluated depends on its attributes (see BaseNode, e.g. deferred, condition,
+        schedule and stale_while_revalidate) and on the novelty attribute of the graph. The returned
+        History lists the nodes that were not evaluated as usual.
+
+        Args:
+            max_workers (int): Number of nodes to evaluate concurrently. Defaults to None (serial evaluation).
+            incremental (bool): If True, nodes whose composed prompt is identical to the one of their last
+                evaluation reuse their previous LLM answer and replay their after-query instead of querying
+                the LLM. Since unchanged results yield unchanged prompts downstream, reuse propagates through
+                the graph. Reused nodes are listed in the reused attribute of the returned History.
+            targets (list): Keys of the nodes that are needed. If set, only the targets and their ancestors
+                (through edges and orders, including temporary edges added during the evaluation) are evaluated.
+                The previous result of every other node is returned, and listed in the skipped attribute of the
+                returned History. Defaults to None (all nodes are evaluated).
+            deadline (float): Time budget of the evaluation in seconds. Once it has passed, nodes that have not
+                started are not evaluated and fall back to their previous result (as with skip_turn) or, if they
+                were never evaluated, to their default_result. The LLM queries in flight are abandoned at the
+                deadline (as with BaseNode.timeout), and their nodes are degraded as well. Degraded nodes are
+                listed in the degraded attribute of the returned History.
+                Defaults to None (no deadline).
+            worker_pool (WorkerPool): Worker processes to run the LLM queries in (see agentkit.workers.WorkerPool).
+                Prompts are composed and AfterQueries are run in this process. Use max_workers (or aevaluate()) to
+                keep several queries in flight. Defaults to None (queries run in this process).
+
+        Returns:
+            History: A dictionary of the results from the graph.
+
+        Raises:
+            AssertionError: If the temporary nodes are not cleared before calling evaluate().
+            LLMQueryError: If the LLM queries of a node that has no result to fall back to failed.
+        """
+        for _ in self.evaluate_iter(max_workers=max_workers, incremental=incremental, targets=targets, deadline=deadline, worker_pool=worker_pool):
+            pass
         return self.history_list[-1]
@@ -0,0 +1,36 @@
+class Hooks:
+    """Base class for subscribers of graph and node events.
+
+    Subclasses override the events they are interested in, and are registered with
+    Graph.subscribe() (events of all nodes) or BaseNode.subscribe() (events of one node).
+    Events are emitted synchronously by the thread that evaluates the node, so subscribers
+    should return quickly and be thread-safe when the graph is evaluated with max_workers.
+    Times are milliseconds since the epoch.
+    """
+    def on_graph_start(self, graph):
+        """Called when an evaluation of the graph starts."""
+        pass
+
+    def on_graph_end(self, graph, history):
+        """Called when an evaluation of the graph is recorded, with its History."""
+        pass
+
+    def on_node_start(self, node):
+        """Called when a node is dispatched by the graph."""
+        pass
+
+    def on_llm_request(self, node, prompt):
+        """Called before each attempt of an LLM query of a node."""
+        pass
+
+    def on_llm_response(self, node, prompt, result, start_time_ms, end_time_ms):
+        """Called after a successful LLM query of a node, with the (result, usage) answer."""
+        pass
+
+    def on_after_query(self, node, after_query_input, error, start_time_ms, end_time_ms):
+        """Called after the AfterQuery of a node has run on after_query_input, with the AfterQueryError it raised (or None). node.result holds the processed result."""
+        pass
+
+    def on_node_end(self, node, result):
+        """Called when the graph records the result of a node (including skipped, degraded and failed nodes)."""
+        pass
@@ -3,7 +3,6 @@ try:
 except ImportError:
     raise ImportError("Please install openai to use built-in LLM API.")
 from openai import OpenAI, AzureOpenAI
-import time
 import os
 from .utils import match_model
 from .base import BaseModel
@@ -79,20 +78,21 @@ class GPT_chat(BaseModel):
     def query_chat(self, messages, shrink_idx, max_gen=512, temp=0.):
         model_max = self.model_max
         messages = self.shrink_msg(messages, shrink_idx, model_max-max_gen)
-        while(True):
+        for attempt in range(self.max_retries + 1):
             try:
                 completion = client.chat.completions.create(
                     model=deployment_name if deployment_name else self.name,
                     messages=messages,
                     temperature=temp,
                     max_tokens=max_gen,
+                    **self.request_kwargs(),
                 )
                 return completion.choices[0].message.content, {"prompt":completion.usage.prompt_tokens, "completion":completion.usage.completion_tokens, "total":completion.usage.total_tokens}
             except Exception as e:
-                if self.debug:
+                if self.debug or attempt == self.max_retries:
                     raise e
                 elif isinstance(e, openai.RateLimitError) or isinstance(e, openai.APIStatusError) or isinstance(e, openai.APITimeoutError) or isinstance(e, openai.APIConnectionError) or isinstance(e, openai.InternalServerError):
-                    time.sleep(30)
+                    self.wait_before_retry(30)
                     print(e)
                 elif "However, your messages resulted in" in str(e):
                     print("error:", e, str(e))
@@ -106,4 +106,4 @@ class GPT_chat(BaseModel):
                 else:
                     print("error:", e)
                     print("retrying in 5 seconds")
-                    time.sleep(5)
+                    self.wait_before_retry(5)
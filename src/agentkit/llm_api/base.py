@@ -1,9 +1,12 @@
 import numpy as np
+from ..node_functions import stop_requested, call_time_left
 
 class BaseModel:
 
     max_gen_default = 1024
     model_max = 2048
+    request_timeout = 600 # seconds per HTTP request (see request_kwargs())
+    max_retries = 10 # retries of a failed request before the error is raised
 
     def __init__(self, model_name, global_conter=None, model_type = "chat"):
         self.name = model_name
@@ -22,6 +25,40 @@ class BaseModel:
     def query_completion(self, messages, shrink_idx, model, max_gen=1024, temp=0.):
         raise NotImplementedError
     
+    def request_kwargs(self):
+        """Keyword arguments for the API client, so that a hung request fails instead of holding its thread.
+
+        The timeout of a request is request_timeout, shortened to the time left before the caller stops
+        waiting for the query (e.g. the timeout of the node, see agentkit.node_functions.call_in_executor()).
+
+        Returns:
+            dict: The keyword arguments.
+
+        Raises:
+            RuntimeError: If the caller stopped waiting for the query.
+        """
+        if stop_requested():
+            raise RuntimeError("LLM query abandoned by its caller")
+        timeout = self.request_timeout
+        time_left = call_time_left()
+        if time_left is not None and (timeout is None or time_left < timeout):
+            timeout = max(time_left, 0.01)
+        if timeout is None:
+            return {}
+        return {"timeout": timeout}
+
+    def wait_before_retry(self, seconds):
+        """Wait before retrying a failed request.
+
+        Args:
+            seconds (float): Time to wait.
+
+        Raises:
+            RuntimeError: If the caller stopped waiting for the query (see agentkit.node_functions.call_in_executor()).
+        """
+        if stop_requested(seconds):
+            raise RuntimeError("LLM query abandoned by its caller")
+
     def encode(self, txt):
         print("Warning: encode is not implemented for this model, returning words.")
         return txt.split(" ")
@@ -56,7 +93,21 @@ class BaseModel:
         
         return result, usage
 
-    
+    def batch(self, msgs, shrink_idxs, max_gen=None, temp=0.):
+        """Query the LLM with a batch of prompts.
+
+        The default implementation queries the prompts one at a time. Backends with batch endpoints
+        or local models should override this method.
+
+        Args:
+            msgs (list): List of prompts in openai format.
+            shrink_idxs (list): List of shrink indices, one per prompt.
+
+        Returns:
+            list: List of (result, usage) pairs.
+        """
+        return [self(msg, shrink_idx, max_gen=max_gen, temp=temp) for msg, shrink_idx in zip(msgs, shrink_idxs)]
+
 
     def shrink_msg_by(self, msg, shrink_idx, L):
         if L <= 0:
@@ -4,7 +4,6 @@ try:
 except ImportError:
     raise ImportError("Please install anthropic to use built-in LLM API.")
 from .utils import match_model
-import time
 from .base import BaseModel
 
 if os.environ.get("ANTHROPIC_KEY") is None:
@@ -79,7 +78,7 @@ class Claude_chat(BaseModel):
         model_max = self.model_max
         messages, system, shrink_idx = self.convert_anthropic(messages, shrink_idx)
         messages = self.shrink_msg(messages, shrink_idx, model_max-max_gen)
-        while(True):
+        for attempt in range(self.max_retries + 1):
             try:
                 message = client.messages.create(
                     model=self.name,
@@ -87,15 +86,16 @@ class Claude_chat(BaseModel):
                     messages=messages,
                     temperature=temp,
                     max_tokens=max_gen,
+                    **self.request_kwargs(),
                 )
                 return message.content[0].text, {"prompt":message.usage.input_tokens, "completion":message.usage.output_tokens, "total":message.usage.input_tokens+message.usage.output_tokens}
             except Exception as e:
-                if self.debug:
+                if self.debug or attempt == self.max_retries:
                     raise e
                 elif isinstance(e, anthropic.APIConnectionError) or isinstance(e, anthropic.APIStatusError) or isinstance(e, anthropic.InternalServerError):
-                    time.sleep(30)
+                    self.wait_before_retry(30)
                 elif isinstance(e, anthropic.RateLimitError):
-                    time.sleep(5*60)
+                    self.wait_before_retry(5*60)
                 elif "However, your messages resulted in" in str(e):
                     print("error:", e, str(e))
                     e = str(e)
@@ -106,5 +106,5 @@ class Claude_chat(BaseModel):
                     model_max = int(re.findall(r'\d+', e[index2 + len("maximum context length is "):])[0])
                     messages = self.shrink_msg_by(messages, shrink_idx, val-model_max)
                 else:
-                    time.sleep(5)
+                    self.wait_before_retry(5)
                     print(e)
\ No newline at end of file
@@ -4,7 +4,6 @@ except ImportError:
     raise ImportError("Please install llama to use Ollama LLM.")
 from typing import List
 from llama import Tokenizer
-import time
 import requests, json
 import os
 from .utils import match_model
@@ -59,10 +58,10 @@ class Ollama_chat(BaseModel):
     def query_chat(self, messages, shrink_idx, max_gen=512, temp=0.):
         model_max = self.model_max
         messages = self.shrink_msg(messages, shrink_idx, model_max-max_gen)
-        while(True):
+        for attempt in range(self.max_retries + 1):
             try:
                 ollama_body = {"messages": messages, "model": self.name, "stream": False}
-                completion = requests.post(self.url,json=ollama_body)
+                completion = requests.post(self.url,json=ollama_body,**self.request_kwargs())
                 print(ollama_body)
                 response = json.loads(completion.content.decode('utf-8'))
                 content = response['message']['content']
@@ -72,6 +71,8 @@ class Ollama_chat(BaseModel):
                 total_tokens = prompt_count + completion_count
                 return content, {"prompt":prompt_count, "completion":completion_count, "total":total_tokens}
             except Exception as e:
+                if attempt == self.max_retries:
+                    raise e
                 e = str(e)
                 if "However, your messages resulted in" in e:
                     print("error:", e)
@@ -82,5 +83,5 @@ class Ollama_chat(BaseModel):
                     model_max = int(re.findall(r'\d+', e[index2 + len("maximum context length is "):])[0])
                     messages = self.shrink_msg_by(messages, shrink_idx, val-model_max)
                 else:
-                    time.sleep(5)
+                    self.wait_before_retry(5)
                     print(e)
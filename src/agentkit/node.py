@@ -1,9 +1,15 @@
 from .exceptions import AfterQueryError
 from collections.abc import Callable, Awaitable
-from .node_functions import error_msg_default
+from .node_functions import error_msg_default, map_reduce_default
 from .base_node import BaseNode
 from .graph import Graph
+from .context import RunState, same_value
 from colorama import Fore, Back, Style
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import copy
+import json
 import typing as t
 
 from .after_query import BaseAfterQuery
@@ -15,8 +21,15 @@ class SimpleDBNode(BaseNode):
     Each node in the graph is an instance of the SimpleDBNode class. The node is evaluated by querying the LLM with a prompt.
 
     Attributes:
-        db (Any): Database object.
+        db (Any): Database object. In an ExecutionContext with a database, the database of the context. While the node is evaluated on a Database, the DatabaseView of the node (see agentkit.database.Database).
     """
+    __slots__ = ()
+
+    # state of the evaluations, kept by the current ExecutionContext (see agentkit.context)
+    db = RunState(inherit=lambda context, db: db if context.database is None else context.database)
+    rendered_prompt = RunState()
+    db_retrieval_results = RunState(factory=list)
+
     def __init__(self, key:str, prompt: str, graph: Graph, query_llm: Callable, compose_prompt: ComposePromptDB, database: t.Any, after_query: BaseAfterQuery = None, error_msg_fn: Callable[[list, str, AfterQueryError], list] = error_msg_default, verbose: bool = False, token_counter: Callable = None):
         """Initializes the SimpleDBNode class.
 
@@ -50,4 +63,175 @@ class SimpleDBNode(BaseNode):
             if self.markdown:
                 print("\n#### Answer\n<span style='color: #d7dbdd;'>\n{}\n</span>".format(msg))
             else:
-                print("Answer: " + Style.DIM + "{}".format(msg) + Style.RESET_ALL)
\ No newline at end of file
+                print("Answer: " + Style.DIM + "{}".format(msg) + Style.RESET_ALL)
+
+class MapNode(SimpleDBNode):
+    """Class for a node that evaluates its prompt once per element of a list, and reduces the results.
+
+    The list is the result of a dependency (a list, or a JSON string of a list), or a db value given
+    by a '$db.path$' placeholder. For each element, the prompt template is rendered with $item$ (the
+    element, JSON-encoded unless it is a string) and $index$, and evaluated by an element node with its
+    own AfterQuery (a copy of element_after_query), retries, timeout and incremental reuse. Elements see
+    the dependencies of the MapNode. Elements are evaluated concurrently (sequentially in GraphBatch).
+    Their results are reduced into the result of the node by reduce_fn, and the after_query of the node
+    runs once on the reduced result.
+
+    Attributes:
+        items (str): Key of the dependency, or '$db.path$' placeholder, holding the list.
+        element_after_query (BaseAfterQuery): AfterQuery validating the result of each element.
+        reduce_fn (Callable): Function (items, results) returning the result of the node.
+        max_concurrency (int): Maximum number of elements evaluated at once. None evaluates all elements at once.
+        elements (list): Element nodes, reused across evaluations by index.
+    """
+    __slots__ = ("items", "element_after_query", "reduce_fn", "max_concurrency", "elements")
+
+    def __init__(self, key:str, prompt: str, graph: Graph, query_llm: Callable, compose_prompt: ComposePromptDB, database: t.Any, items: str, element_after_query: BaseAfterQuery = None, reduce_fn: Callable[[list, list], t.Any] = map_reduce_default, max_concurrency: int = None, after_query: BaseAfterQuery = None, error_msg_fn: Callable[[list, str, AfterQueryError], list] = error_msg_default, verbose: bool = False, token_counter: Callable = None):
+        """Initializes the MapNode class.
+
+        Args:
+            key (str): Unique key for the node.
+            prompt (str): Prompt template for each element, with $item$ and $index$ placeholders.
+            graph (Graph): Graph object.
+            query_llm (Callable): Function to query the LLM.
+            compose_prompt (ComposePromptDB): ComposePromptDB object (copied for each element).
+            database (Any): Database object.
+            items (str): Key of the dependency, or '$db.path$' placeholder, holding the list.
+            element_after_query (BaseAfterQuery): AfterQuery validating the result of each element (copied for each element).
+            reduce_fn (Callable): Function (items, results) returning the result of the node.
+            max_concurrency (int): Maximum number of elements evaluated at once.
+            after_query (BaseAfterQuery): AfterQuery of the reduced result.
+            error_msg_fn (Callable): Function to add error message to the prompt.
+            verbose (bool): Verbose flag.
+            token_counter (Callable): Function to count tokens.
+        """
+        super().__init__(key, prompt, graph, query_llm, compose_prompt, database, after_query=after_query, error_msg_fn=error_msg_fn, verbose=verbose, token_counter=token_counter)
+        self.items = items
+        self.element_after_query = element_after_query
+        self.reduce_fn = reduce_fn
+        self.max_concurrency = max_concurrency
+        self.elements = []
+
+    def get_items(self):
+        """Get the list to map over.
+
+        Returns:
+            list: The elements.
+
+        Raises:
+            AssertionError: If the value is not a list.
+        """
+        if self.items.startswith("$db.") and self.items.endswith("$"):
+            value = self.db
+            for key in self.items[len("$db."):-1].split('.'):
+                value = value[key]
+        else:
+            value = self.graph.get_node_with_temporary(self.items).result
+            if isinstance(value, str):
+                value = json.loads(value)
+        assert isinstance(value, list), "MapNode ({}) expects a list to map over, got {}".format(self.key, type(value))
+        return value
+
+    def _prepare(self):
+        self._check_dependencies()
+        self.reused = False
+        self._llm_time = 0.
+        items = self.get_items()
+        while len(self.elements) < len(items):
+            self.elements.append(_MapElement(self, len(self.elements)))
+        elements = self.elements[:len(items)]
+        for index, (element, item) in enumerate(zip(elements, items)):
+            item = item if isinstance(item, str) else json.dumps(item)
+            element.prompt = self.prompt.replace("$item$", item).replace("$index$", str(index))
+            element.graph = self.graph
+            element.db = self.db
+            element.query_llm = self.query_llm
+            element.timeout = self.timeout
+            element.max_attempts = self.max_attempts
+            element.verbose = self.verbose
+        return items, elements
+
+    def _reduce(self, items, elements):
+        # reduce the element results and run the AfterQuery of the node (a generator step, see _evaluation())
+        self.result = self.reduce_fn(items, [element.result for element in elements])
+        self.reused = len(elements) > 0 and all(element.reused for element in elements)
+        self._llm_time = sum(element._llm_time for element in elements)
+        yield from self._after_query(ignore_errors=True)
+        self._update_latency()
+        self._print_answer(self.result)
+        return self.result
+
+    def _evaluation(self, fuse=True):
+        # map nodes are not fused (see agentkit.fusion.fuse_nodes())
+        if self.temporary_skip:
+            self.temporary_skip = False
+            return self.result
+        items, elements = self._prepare()
+        for element in elements:
+            yield from element._evaluation()
+        return (yield from self._reduce(items, elements))
+
+    def evaluate(self):
+        """Evaluate the node, querying the LLM for all elements concurrently in threads.
+
+        Returns:
+            str: Result of the node evaluation.
+
+        Raises:
+            AssertionError: If any dependency of the node has not been evaluated.
+            LLMQueryError: If all attempts of an LLM query of an element failed.
+        """
+        if self.temporary_skip:
+            self.temporary_skip = False
+            return self.result
+        items, elements = self._prepare()
+        if len(elements) > 0:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency or len(elements)) as executor:
+                contexts = [contextvars.copy_context() for _ in elements] # e.g. the ExecutionContext of the graph
+                list(executor.map(lambda element, context: context.run(element.evaluate), elements, contexts))
+        return self._run(self._reduce(items, elements))
+
+    async def aevaluate(self, executor=None):
+        """Evaluate the node, awaiting the LLM for all elements concurrently.
+
+        Args:
+            executor (concurrent.futures.Executor): Executor for synchronous query_llm callables.
+
+        Returns:
+            str: Result of the node evaluation.
+
+        Raises:
+            AssertionError: If any dependency of the node has not been evaluated.
+            LLMQueryError: If all attempts of an LLM query of an element failed.
+        """
+        if self.temporary_skip:
+            self.temporary_skip = False
+            return self.result
+        items, elements = self._prepare()
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency is not None else None
+        async def evaluate_element(element):
+            if semaphore is None:
+                return await element.aevaluate(executor=executor)
+            async with semaphore:
+                return await element.aevaluate(executor=executor)
+        tasks = [asyncio.ensure_future(evaluate_element(element)) for element in elements]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return await self._arun(self._reduce(items, elements), executor)
+
+class _MapElement(SimpleDBNode):
+    """An element of a MapNode. It is not part of the graph."""
+    __slots__ = ("parent",)
+
+    prompt = RunState(inherit=same_value)
+
+    def __init__(self, parent, index):
+        after_query = copy.copy(parent.element_after_query) if parent.element_after_query is not None else None
+        super().__init__("{}[{}]".format(parent.key, index), None, parent.graph, parent.query_llm, copy.copy(parent._compose_prompt), parent.db, after_query=after_query, error_msg_fn=parent._add_error_msg, verbose=parent.verbose, token_counter=parent.token_counter)
+        self.parent = parent
+        self.counts = parent.counts
+
+    def get_dependencies(self):
+        return self.parent.get_dependencies()
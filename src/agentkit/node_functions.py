@@ -1,3 +1,11 @@
+import concurrent.futures
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+
 def error_msg_default(prompt, result, error):
     """Default function to append the error message to the prompt.
 
@@ -11,4 +19,158 @@ def error_msg_default(prompt, result, error):
     """
     prompt.append({"role":"assistant", "content":result})
     prompt.append({"role":"user", "content":error})
-    return prompt
\ No newline at end of file
+    return prompt
+
+def map_reduce_default(items, results):
+    """Default function to reduce the element results of a MapNode.
+
+    Args:
+        items (list): Elements of the list the node was mapped over.
+        results (list): Result of each element.
+
+    Returns:
+        str: A JSON object mapping each item to its result if all items are strings, or a JSON list of {"item", "result"} objects otherwise.
+    """
+    if all(isinstance(item, str) for item in items):
+        return json.dumps({item: result for item, result in zip(items, results)}, default=str)
+    return json.dumps([{"item": item, "result": result} for item, result in zip(items, results)], default=str)
+
+def is_async_callable(fn):
+    """Check if a function (or callable object) returns a coroutine when called.
+
+    Args:
+        fn (Callable): Function to check.
+
+    Returns:
+        bool: True if calling fn returns a coroutine.
+    """
+    while hasattr(fn, 'func'): # functools.partial
+        fn = fn.func
+    return inspect.iscoroutinefunction(fn) or inspect.iscoroutinefunction(getattr(fn, '__call__', None))
+
+def get_batch_query(fn):
+    """Get the batch version of an LLM query function.
+
+    A query function is batch-capable if it has a ``batch`` method taking a list of prompts and a list
+    of shrink indices and returning a list of (result, usage) pairs. functools.partial wrappers of
+    batch-capable functions are supported, with the same bound arguments.
+
+    Args:
+        fn (Callable): LLM query function.
+
+    Returns:
+        Callable: The batch query function, or None if fn is not batch-capable.
+    """
+    if hasattr(fn, 'batch'):
+        return fn.batch
+    if isinstance(fn, functools.partial) and hasattr(fn.func, 'batch'):
+        return functools.partial(fn.func.batch, *fn.args, **fn.keywords)
+    return None
+
+_current_call = contextvars.ContextVar("agentkit_thread_call", default=None)
+
+class ThreadCall(concurrent.futures.Future):
+    """Future of a call_in_thread() or call_in_executor() call."""
+    def __init__(self, timeout=None):
+        super().__init__()
+        self._stop = threading.Event()
+        self._deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def abandon(self):
+        """Tell the call that its caller stopped waiting for it (see stop_requested()). A call that has not started is cancelled."""
+        self.cancel()
+        self._stop.set()
+
+    def _run(self, context, fn, args):
+        if not self.set_running_or_notify_cancel():
+            return
+        try:
+            self.set_result(context.run(self._call, fn, args))
+        except BaseException as e:
+            self.set_exception(e)
+
+    def _call(self, fn, args):
+        _current_call.set(self)
+        return fn(*args)
+
+def call_in_thread(fn, *args):
+    """Call a function in a new daemon thread.
+
+    Used for long-running background work (e.g. the deferred nodes of an evaluation), which
+    would otherwise hold a worker of a pool. LLM queries use call_in_executor().
+
+    Args:
+        fn (Callable): Function to call.
+        *args: Arguments of the call.
+
+    Returns:
+        ThreadCall: Future of the result of the call.
+    """
+    future = ThreadCall()
+    context = contextvars.copy_context() # e.g. the ExecutionContext of the caller
+    threading.Thread(target=future._run, args=(context, fn, args), daemon=True).start()
+    return future
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def query_executor():
+    """Get the thread pool shared by the LLM queries that are called with a timeout.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The executor (with the default number of workers).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="agentkit-query")
+        return _executor
+
+def call_in_executor(fn, *args, executor=None, timeout=None):
+    """Call a function in a bounded executor, so that its caller can stop waiting for it.
+
+    Python threads cannot be interrupted. When the caller stops waiting, it abandon()s the returned
+    future: a call that has not started is cancelled, and a running call stops at its next
+    stop_requested() check (e.g. before a retry of agentkit.llm_api.base.BaseModel). The time its
+    caller waits for it is available to the call (see call_time_left()), e.g. to bound its HTTP requests.
+
+    Args:
+        fn (Callable): Function to call.
+        *args: Arguments of the call.
+        executor (concurrent.futures.Executor): Executor of the call. Defaults to None (query_executor()).
+        timeout (float): Seconds the caller waits for the call. Defaults to None (no limit).
+
+    Returns:
+        ThreadCall: Future of the result of the call.
+    """
+    future = ThreadCall(timeout)
+    context = contextvars.copy_context() # e.g. the ExecutionContext of the caller
+    (executor or query_executor()).submit(future._run, context, fn, args)
+    return future
+
+def stop_requested(timeout=None):
+    """Check whether the current call_in_thread() or call_in_executor() call was abandoned by its caller.
+
+    Args:
+        timeout (float): Seconds to wait for the call to be abandoned. Defaults to None (do not wait).
+
+    Returns:
+        bool: True if the call was abandoned. Always False outside of such a call.
+    """
+    call = _current_call.get()
+    if call is None:
+        if timeout is not None:
+            time.sleep(timeout)
+        return False
+    return call._stop.wait(timeout) if timeout is not None else call._stop.is_set()
+
+def call_time_left():
+    """Get the time left before the caller of the current call_in_executor() call stops waiting for it.
+
+    Returns:
+        float: Seconds left (at least 0), or None if the caller waits without a limit or outside of such a call.
+    """
+    call = _current_call.get()
+    if call is None or call._deadline is None:
+        return None
+    return max(0., call._deadline - time.monotonic())
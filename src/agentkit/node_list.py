@@ -0,0 +1,106 @@
+# states of a node in a NodeList
+_ABSENT, _HIDDEN, _PRESENT = 0, 1, 2
+
+class NodeList:
+    """An insertion-ordered set of nodes with a list-like interface.
+
+    Used for the adjacency of nodes (adjacent_to, adjacent_from, evaluate_after, evaluate_before).
+    Membership tests, appends and removals are O(1), and iteration follows the insertion order,
+    which is the order of the dependencies in composed prompts.
+
+    A removed node is hidden rather than deleted, so that restoring it (when a temporarily removed
+    edge is reverted) puts it back at its original position in O(1).
+    """
+    __slots__ = ("_nodes", "_len")
+
+    def __init__(self, nodes=()):
+        """Initializes the NodeList class.
+
+        Args:
+            nodes (Iterable): Initial nodes.
+        """
+        self._nodes = {} # node -> visible
+        self._len = 0
+        for node in nodes:
+            self.append(node)
+
+    def __contains__(self, node):
+        return self._nodes.get(node, False)
+
+    def __iter__(self):
+        return (node for node, visible in self._nodes.items() if visible)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "NodeList({})".format([node.key for node in self])
+
+    def append(self, node):
+        """Add a node at the end (or back at its position if it was removed).
+
+        Raises:
+            AssertionError: If the node is already in the list.
+        """
+        assert not self._nodes.get(node, False), "Node ({}) is already in the list".format(node.key)
+        self._nodes[node] = True
+        self._len += 1
+
+    def insert(self, index, node):
+        """Add a node at a position (O(n)).
+
+        Raises:
+            AssertionError: If the node is already in the list.
+        """
+        assert not self._nodes.get(node, False), "Node ({}) is already in the list".format(node.key)
+        self._nodes.pop(node, None)
+        items = list(self._nodes.items())
+        position = len(items)
+        for i, (_, visible) in enumerate(items):
+            if visible:
+                if index == 0:
+                    position = i
+                    break
+                index -= 1
+        items.insert(position, (node, True))
+        self._nodes = dict(items)
+        self._len += 1
+
+    def remove(self, node):
+        """Remove a node, keeping its position in case it is added back.
+
+        Raises:
+            ValueError: If the node is not in the list.
+        """
+        if not self._nodes.get(node, False):
+            raise ValueError("Node ({}) is not in the list".format(node.key))
+        self._nodes[node] = False
+        self._len -= 1
+
+    def _state(self, node):
+        if node not in self._nodes:
+            return _ABSENT
+        return _PRESENT if self._nodes[node] else _HIDDEN
+
+    def _set_state(self, node, state):
+        visible = self._nodes.get(node, False)
+        if state == _ABSENT:
+            self._nodes.pop(node, None)
+        else:
+            self._nodes[node] = state == _PRESENT
+        self._len += (state == _PRESENT) - visible
+
+    def _copy_state(self):
+        return dict(self._nodes), self._len
+
+    def _restore_state(self, state):
+        self._nodes, self._len = state
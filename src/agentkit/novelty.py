@@ -0,0 +1,178 @@
+from .context import RunState, RunValues, current_context
+import copy
+import difflib
+import json
+
+_MISSING = object()
+
+def _text(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True, default=str)
+
+def text_similarity(previous, current):
+    """Similarity of two values, as the similarity of their text (JSON unless they are strings).
+
+    Args:
+        previous (Any): Previous value.
+        current (Any): Current value.
+
+    Returns:
+        float: Similarity between 0 (different) and 1 (identical).
+    """
+    if previous == current:
+        return 1.
+    return difflib.SequenceMatcher(None, _text(previous), _text(current), autojunk=False).ratio()
+
+def _new_savings():
+    return {'evaluations': 0, 'fast_evaluations': 0, 'calls': 0, 'prompt': 0, 'completion': 0}
+
+class NoveltyDetector:
+    """Lets the evaluations of a graph take a fast path when the observation is effectively unchanged.
+
+    At the beginning of each evaluation (see Graph.novelty), the designated database values (e.g. the
+    observation, inventory and vitals) are compared with their values at the last full evaluation. If
+    the novelty (1 - their weighted similarity) is below the threshold, only the nodes of the fast path
+    (e.g. the actor nodes) are evaluated, and every other node reuses its cached result, as if it were
+    not due (see BaseNode.schedule). Nodes that have never been evaluated are always evaluated.
+
+    The savings of the current episode are counted in savings: the number of evaluations and fast
+    evaluations, and the LLM calls and tokens that the cached nodes spent at their last evaluation (from
+    BaseNode.counts, so query_llm must return the usage or the nodes must have a token_counter).
+    end_episode() moves them to episodes. The state of the detector is kept by the ExecutionContext of the
+    evaluation, so that a detector can be shared by several sessions.
+
+    Attributes:
+        fields (dict): Weight of each database value, by dotted path as in '$db.path$' placeholders (e.g. 'environment.observation_current').
+        threshold (float): Novelty below which an evaluation takes the fast path.
+        fast_path (set): Keys of the nodes evaluated by fast evaluations.
+        database (dict): The database, or None to use the database of the ExecutionContext.
+        similarity (Callable): Function of (previous value, current value) giving their similarity between 0 and 1.
+        max_fast (int): Maximum number of consecutive fast evaluations, or None for no limit.
+        savings (dict): Savings of the current episode.
+        episodes (list): Savings of each previous episode.
+    """
+    # state of the evaluations, kept by the current ExecutionContext (see agentkit.context)
+    savings = RunState(factory=_new_savings)
+    episodes = RunState(factory=list)
+    _reference = RunState()
+    _fast_streak = RunState(default=0)
+    _counts = RunState() # key -> number of LLM calls of the node at the beginning of the last evaluation
+    _costs = RunState(factory=dict) # key -> (calls, prompt, completion) of the last evaluation of the node that queried the LLM
+
+    def __init__(self, fields, fast_path, threshold=0.05, database=None, similarity=text_similarity, max_fast=None):
+        """Initializes the NoveltyDetector class.
+
+        Args:
+            fields (list): Dotted paths of the database values, or a dict of their weights.
+            fast_path (list): Keys of the nodes evaluated by fast evaluations.
+            threshold (float): Novelty below which an evaluation takes the fast path.
+            database (dict): The database. Defaults to None (the database of the ExecutionContext).
+            similarity (Callable): Function of (previous value, current value) giving their similarity between 0 and 1.
+            max_fast (int): Maximum number of consecutive fast evaluations. Defaults to None (no limit).
+
+        Raises:
+            AssertionError: If no field is given.
+        """
+        self._own_state = RunValues(type(self))
+        self.fields = dict(fields) if isinstance(fields, dict) else {path: 1. for path in fields}
+        assert len(self.fields) > 0, "NoveltyDetector requires at least one field"
+        self.fast_path = set(fast_path)
+        self.threshold = threshold
+        self.database = database
+        self.similarity = similarity
+        self.max_fast = max_fast
+
+    def values(self):
+        """Get the current database values of the fields.
+
+        Returns:
+            dict: The value of each field (missing values are omitted).
+
+        Raises:
+            AssertionError: If there is no database.
+        """
+        context = current_context()
+        database = context.database if context is not None and context.database is not None else self.database
+        assert database is not None, "NoveltyDetector has no database"
+        values = {}
+        for path in self.fields:
+            value = database
+            for key in path.split('.'):
+                if isinstance(value, dict) and key in value:
+                    value = value[key]
+                else:
+                    value = _MISSING
+                    break
+            if value is not _MISSING:
+                values[path] = value
+        return values
+
+    def novelty(self, values):
+        """Novelty of database values with respect to the last full evaluation.
+
+        Args:
+            values (dict): The value of each field (see values()).
+
+        Returns:
+            float: Novelty between 0 (unchanged) and 1. 1 if there was no full evaluation yet.
+        """
+        if self._reference is None:
+            return 1.
+        similarity = 0.
+        for path, weight in self.fields.items():
+            previous, current = self._reference.get(path, _MISSING), values.get(path, _MISSING)
+            if previous is _MISSING or current is _MISSING:
+                similarity += weight * (previous is current)
+            else:
+                similarity += weight * self.similarity(previous, current)
+        return 1. - similarity / sum(self.fields.values())
+
+    def end_episode(self):
+        """End the current episode: its savings are moved to episodes, and the next evaluation is a full one.
+
+        Returns:
+            dict: Savings of the episode.
+        """
+        savings = self.savings
+        self.episodes.append(savings)
+        self.savings = _new_savings()
+        self._reference = None
+        self._fast_streak = 0
+        return savings
+
+    def _record_costs(self, graph):
+        # LLM usage of the nodes during the previous evaluation, whose deferred nodes have completed
+        if self._counts is not None:
+            for key, start in self._counts.items():
+                node = graph.nodes.get(key)
+                counts = node.counts[start:] if node is not None else []
+                if len(counts) > 0:
+                    self._costs[key] = (len(counts), sum(c['prompt'] for c in counts), sum(c['completion'] for c in counts))
+        self._counts = {key: len(node.counts) for key, node in graph.nodes.items()}
+
+    def _begin(self, graph):
+        """Decide whether an evaluation of the graph takes the fast path.
+
+        Returns:
+            tuple: (novelty, fast).
+        """
+        self._record_costs(graph)
+        values = self.values()
+        novelty = self.novelty(values)
+        fast = novelty < self.threshold and (self.max_fast is None or self._fast_streak < self.max_fast)
+        self.savings['evaluations'] += 1
+        if fast:
+            self.savings['fast_evaluations'] += 1
+            self._fast_streak += 1
+        else:
+            self._reference = copy.deepcopy(values)
+            self._fast_streak = 0
+        return novelty, fast
+
+    def _saved(self, key):
+        # a node reused its cached result in a fast evaluation
+        calls, prompt, completion = self._costs.get(key, (0, 0, 0))
+        self.savings['calls'] += calls
+        self.savings['prompt'] += prompt
+        self.savings['completion'] += completion
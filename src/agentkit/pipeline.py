@@ -0,0 +1,264 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .timeline import Timeline
+import asyncio
+import contextvars
+import copy
+
+_MISSING = object()
+
+class _Snapshot(dict):
+    """A copy of the database that records which top-level keys are read and written."""
+    def __init__(self, data):
+        super().__init__(data)
+        self.read = set()
+        self.written = set()
+        self.read_all = False
+
+    def _read(self, key):
+        if key not in self.written: # reads of values written by the evaluation do not depend on the database
+            self.read.add(key)
+
+    def __getitem__(self, key):
+        self._read(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._read(key)
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        self._read(key)
+        return super().__contains__(key)
+
+    def __setitem__(self, key, value):
+        self.written.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.written.add(key)
+        super().__delitem__(key)
+
+    def setdefault(self, key, default=None):
+        self._read(key)
+        self.written.add(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        self._read(key)
+        self.written.add(key)
+        return super().pop(key, *args)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def _reads_all(self):
+        self.read_all = True
+
+    def __iter__(self):
+        self._reads_all()
+        return super().__iter__()
+
+    def __len__(self):
+        self._reads_all()
+        return super().__len__()
+
+    def keys(self):
+        self._reads_all()
+        return super().keys()
+
+    def values(self):
+        self._reads_all()
+        return super().values()
+
+    def items(self):
+        self._reads_all()
+        return super().items()
+
+class _AheadView:
+    """The graph as seen by the nodes that a Pipeline evaluates ahead of their evaluation."""
+    def __init__(self, graph, incremental, worker_pool):
+        self._graph = graph
+        self.timeline = Timeline()
+        self.incremental = incremental
+        self.worker_pool = worker_pool
+
+    def __getattr__(self, name):
+        return getattr(self._graph, name)
+
+    def _time_left(self):
+        # nodes evaluated ahead do not count against the deadline of the evaluation
+        return None
+
+    def _modify(self, *args, **kwargs):
+        raise AssertionError("Nodes evaluated ahead by a Pipeline must not modify the graph")
+
+    add_temporary_node = add_edge_temporary = remove_edge_temporary = skip_nodes_temporary = _modify
+
+def _copy_while_written(value):
+    # the deferred nodes may write to the database while it is copied
+    while True:
+        try:
+            return copy.deepcopy(value)
+        except RuntimeError: # changed size during iteration
+            continue
+
+class Pipeline:
+    """A driver that overlaps each evaluation of a graph with the deferred nodes of the previous one.
+
+    Without a pipeline, an evaluation waits for the deferred nodes of the previous evaluation (see
+    BaseNode.deferred) before it starts. With a pipeline, the nodes that do not depend on them (e.g. the
+    observation nodes of the next step) are evaluated ahead, while the deferred nodes are still running.
+
+    Nodes evaluated ahead read from a snapshot of the database, taken when the evaluation starts, with the
+    updates of the evaluation applied. Their writes go to the snapshot and become visible once the deferred
+    nodes have completed, so that the writes of the evaluations are applied in order. The top-level keys they
+    read are recorded: if the deferred nodes changed one of them in the meantime, the results would differ from
+    a sequential evaluation, so they are discarded and the nodes are evaluated again as usual. The database
+    should hold plain data (values are deep-copied and compared with ==), and its values should be accessed
+    through the dict interface.
+
+    A node is evaluated ahead if all its dependencies and orders are, it is not deferred,
+    stale_while_revalidate, conditional or scheduled, its database (if any) is the database of the pipeline, it is not touched by
+    temporary edges, and the deferred nodes that depend on it have composed their prompts. Its AfterQuery
+    must not modify the graph; if it does, the nodes are evaluated again as usual.
+
+    Attributes:
+        graph (Graph): The graph to evaluate.
+        database (dict): The database of the nodes.
+        conflicts (int): Number of evaluations whose nodes evaluated ahead were discarded.
+    """
+    def __init__(self, graph, database):
+        """Initializes the Pipeline class.
+
+        Args:
+            graph (Graph): The graph to evaluate.
+            database (dict): The database of the nodes.
+        """
+        self.graph = graph
+        self.database = database
+        self.conflicts = 0
+
+    def evaluate(self, updates=None, max_workers=None, incremental=False, targets=None, deadline=None, worker_pool=None):
+        """Evaluate the graph, starting while the deferred nodes of the previous evaluation are running.
+
+        Args:
+            updates (dict): Top-level database values written by this evaluation (e.g. the new observation). Do not write them to the database directly, since the deferred nodes of the previous evaluation may still read it.
+            max_workers (int): Number of nodes to evaluate concurrently (see Graph.evaluate()).
+            incremental (bool): Reuse the previous result of nodes whose composed prompt did not change (see Graph.evaluate()).
+            targets (list): Keys of the nodes to evaluate, together with their ancestors (see Graph.evaluate()).
+            deadline (float): Time budget of the evaluation in seconds (see Graph.evaluate()). Nodes evaluated ahead do not count against it.
+            worker_pool (WorkerPool): Worker processes to run the LLM queries in (see Graph.evaluate()).
+
+        Returns:
+            History: A dictionary of the results from the graph. The nodes that were evaluated ahead are listed in its prefetched attribute.
+        """
+        updates = updates or {}
+        graph = self.graph
+        tail = graph._tail
+        ahead = []
+        if tail is not None and not tail.done() and not isinstance(tail, asyncio.Future):
+            with graph._lock:
+                ahead = self._ahead_keys(targets)
+        if len(ahead) == 0:
+            graph.join()
+            self.database.update(updates)
+        else:
+            base = _copy_while_written(self.database)
+            snapshot = _Snapshot(copy.deepcopy(base))
+            for key, value in updates.items():
+                snapshot[key] = value
+            view = _AheadView(graph, incremental, worker_pool)
+            results = self._evaluate_ahead(ahead, view, snapshot, max_workers)
+            graph.join()
+            if results is not None and self._consistent(base, snapshot):
+                self._commit(base, snapshot)
+                graph._prefetched = results
+                graph._prefetch_timeline = view.timeline
+            else:
+                self.conflicts += 1
+                self.database.update(updates)
+        return graph.evaluate(max_workers=max_workers, incremental=incremental, targets=targets, deadline=deadline, worker_pool=worker_pool)
+
+    def _ahead_keys(self, targets):
+        # keys of the nodes to evaluate ahead, in topological order
+        graph = self.graph
+        history = graph.history_list[-1]
+        pending = set(key for key in history.deferred if key not in history)
+        composed = set(key for _, key, event, _ in list(history.timeline.events) if event == "compose_end")
+        touched = set(key for edge in list(graph.temporary_edges) + list(graph.temporary_removed_edges) for key in edge)
+        if graph._plan is None:
+            graph.compile()
+        plan = graph._plan
+        required = None
+        if targets is not None:
+            required = set()
+            stack = list(targets)
+            while len(stack) > 0:
+                key = stack.pop()
+                if key not in required:
+                    required.add(key)
+                    stack += [node.key for node in graph.nodes[key].get_dependencies_inc_order()]
+        ahead = []
+        for i in plan.topological_order():
+            key, node = plan.keys[i], plan.nodes[i]
+            if key in pending or key in touched or node.deferred or node.stale_while_revalidate or node.condition is not None or node.schedule is not None:
+                continue
+            if getattr(node, "db", self.database) is not self.database or (required is not None and key not in required):
+                continue
+            if any(dependency.key not in ahead for dependency in node.get_dependencies_inc_order()):
+                continue
+            if any(successor.key in pending and successor.key not in composed for successor in node.adjacent_to):
+                continue # the deferred node still has to read the previous result
+            ahead.append(key)
+        return ahead
+
+    def _evaluate_ahead(self, keys, view, snapshot, max_workers):
+        """Evaluate nodes on the snapshot of the database.
+
+        Returns:
+            dict: The result of each node, or None if a node failed.
+        """
+        nodes = [self.graph.nodes[key] for key in keys]
+        for node in nodes:
+            node.graph = view
+            if hasattr(node, "db"):
+                node.db = snapshot
+        results = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers or 1) as executor:
+                waiting = list(nodes)
+                futures = {}
+                while len(waiting) > 0 or len(futures) > 0:
+                    for node in list(waiting):
+                        if all(dependency.key in results for dependency in node.get_dependencies_inc_order()):
+                            waiting.remove(node)
+                            futures[executor.submit(contextvars.copy_context().run, node.evaluate)] = node.key
+                    done, _ = wait(futures.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = futures.pop(future)
+                        try:
+                            results[key] = future.result()
+                        except Exception: # evaluated again as usual
+                            return None
+        finally:
+            for node in nodes:
+                node.graph = self.graph
+                if hasattr(node, "db"):
+                    node.db = self.database
+        return results
+
+    def _consistent(self, base, snapshot):
+        # whether the values read from the snapshot are still those of the database
+        keys = set(base.keys()) | set(self.database.keys()) if snapshot.read_all else snapshot.read
+        return all(self.database.get(key, _MISSING) == base.get(key, _MISSING) for key in keys)
+
+    def _commit(self, base, snapshot):
+        # values that were read may have been modified in place
+        keys = set(dict.keys(snapshot)) | set(base.keys()) if snapshot.read_all else snapshot.read | snapshot.written
+        for key in keys:
+            value = dict.get(snapshot, key, _MISSING)
+            if value is _MISSING:
+                self.database.pop(key, None)
+            elif value != base.get(key, _MISSING):
+                self.database[key] = value
@@ -0,0 +1,77 @@
+class ExecutionPlan:
+    """A compiled snapshot of the permanent topology of a graph.
+
+    Nodes are identified by integer ids (their position in keys), so that the scheduler
+    can track the evaluation with flat arrays instead of resolving nodes by key.
+    The plan is built by Graph.compile() and reused across evaluations until the
+    permanent graph changes. Temporary nodes and edges are patched on top of it
+    during each evaluation.
+
+    Attributes:
+        keys (list): Key of each node, indexed by node id.
+        nodes (list): Node object of each node, indexed by node id.
+        index (dict): Node id of each key.
+        dep_counts (list): Number of dependencies (edges and orders) of each node.
+        successors (list): Ids of the nodes that depend on each node through an edge.
+        order_successors (list): Ids of the nodes that are ordered after each node.
+        roots (list): Ids of the nodes without incoming edges.
+        levels (list): Topological levels. Each level is a list of node ids whose dependencies and orders all lie in earlier levels.
+        ranks (list): Position of each node in topological_order(), indexed by node id.
+    """
+    def __init__(self, nodes, edges, orders):
+        """Initializes the ExecutionPlan class.
+
+        Args:
+            nodes (dict): A dictionary of all (permanent) nodes in the graph.
+            edges (list): A list of (from_key, to_key) edges.
+            orders (list): A list of (from_key, to_key) orders.
+
+        Raises:
+            ValueError: If the edges and orders contain a cycle.
+        """
+        self.keys = list(nodes.keys())
+        self.nodes = list(nodes.values())
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.dep_counts = [0] * len(self.keys)
+        self.successors = [[] for _ in self.keys]
+        self.order_successors = [[] for _ in self.keys]
+        has_edge = [False] * len(self.keys)
+        for from_key, to_key in edges:
+            self.successors[self.index[from_key]].append(self.index[to_key])
+            self.dep_counts[self.index[to_key]] += 1
+            has_edge[self.index[to_key]] = True
+        for from_key, to_key in orders:
+            self.order_successors[self.index[from_key]].append(self.index[to_key])
+            self.dep_counts[self.index[to_key]] += 1
+        self.roots = [i for i in range(len(self.keys)) if not has_edge[i]]
+        self.levels = self._compute_levels()
+        self.ranks = [0] * len(self.keys)
+        for rank, i in enumerate(self.topological_order()):
+            self.ranks[i] = rank
+
+    def _compute_levels(self):
+        remaining = list(self.dep_counts)
+        level = [i for i in range(len(self.keys)) if remaining[i] == 0]
+        levels = []
+        visited = 0
+        while len(level) > 0:
+            levels.append(level)
+            visited += len(level)
+            next_level = []
+            for i in level:
+                for j in self.successors[i] + self.order_successors[i]:
+                    remaining[j] -= 1
+                    if remaining[j] == 0:
+                        next_level.append(j)
+            level = next_level
+        if visited != len(self.keys):
+            raise ValueError("Graph contains a cycle: {}".format([self.keys[i] for i in range(len(self.keys)) if remaining[i] > 0]))
+        return levels
+
+    def topological_order(self):
+        """Get the node ids in a topological order.
+
+        Returns:
+            list: Node ids, level by level.
+        """
+        return [i for level in self.levels for i in level]
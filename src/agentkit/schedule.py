@@ -0,0 +1,114 @@
+import copy
+
+_MISSING = object()
+
+class Schedule:
+    """Base class for the schedule of a node that does not need to be evaluated at every iteration (see BaseNode.schedule).
+
+    When a scheduled node is not due, the graph reports its cached result to its dependents instead of
+    evaluating it, and lists it in History.cached. A node that has never been evaluated is always due.
+    The dependencies of the node are still evaluated if other nodes need them; give them a schedule too
+    to leave them out.
+    """
+    def due(self, node, num_iter):
+        """Whether the node has to be evaluated at this iteration.
+
+        Args:
+            node (BaseNode): The node, whose dependencies have been evaluated.
+            num_iter (int): Index of the current iteration of the graph.
+
+        Returns:
+            bool: True if the node has to be evaluated.
+        """
+        raise NotImplementedError
+
+    def evaluated(self, node, num_iter):
+        """Called when a due node is evaluated.
+
+        Args:
+            node (BaseNode): The node.
+            num_iter (int): Index of the current iteration of the graph.
+        """
+        pass
+
+class Every(Schedule):
+    """Evaluate the node every period iterations.
+
+    Attributes:
+        period (int): Number of iterations between two evaluations.
+        offset (int): Iteration of the first evaluation.
+    """
+    def __init__(self, period, offset=0):
+        """Initializes the Every class.
+
+        Args:
+            period (int): Number of iterations between two evaluations.
+            offset (int): Iteration of the first evaluation.
+
+        Raises:
+            AssertionError: If the period is not positive.
+        """
+        assert period > 0, "Invalid period: {}".format(period)
+        self.period = period
+        self.offset = offset
+
+    def due(self, node, num_iter):
+        return num_iter >= self.offset and (num_iter - self.offset) % self.period == 0
+
+class OnChange(Schedule):
+    """Evaluate the node when a database value changed since its last evaluation.
+
+    Values are given by dotted paths into node.db, as in '$db.path$' placeholders (e.g. 'kb.knowledge_base').
+    A copy of the values is kept after each evaluation, in the ExecutionContext of the evaluation.
+
+    Attributes:
+        paths (tuple): Dotted paths of the database values.
+    """
+    def __init__(self, *paths):
+        """Initializes the OnChange class.
+
+        Args:
+            *paths (str): Dotted paths of the database values.
+        """
+        self.paths = paths
+
+    def _values(self, node):
+        values = []
+        for path in self.paths:
+            value = node.db
+            for key in path.split('.'):
+                if isinstance(value, dict) and key in value:
+                    value = value[key]
+                else:
+                    value = _MISSING
+                    break
+            values.append(value)
+        return values
+
+    def due(self, node, num_iter):
+        seen = node._schedule_values.get(id(self), _MISSING)
+        return seen is _MISSING or seen != self._values(node)
+
+    def evaluated(self, node, num_iter):
+        node._schedule_values[id(self)] = copy.deepcopy(self._values(node), {id(_MISSING): _MISSING})
+
+class AnyOf(Schedule):
+    """Evaluate the node when any of several schedules is due (e.g. AnyOf(Every(25), OnChange('kb'))).
+
+    Attributes:
+        schedules (tuple): The schedules.
+    """
+    def __init__(self, *schedules):
+        """Initializes the AnyOf class.
+
+        Args:
+            *schedules (Schedule): The schedules.
+        """
+        self.schedules = schedules
+
+    def due(self, node, num_iter):
+        return any(schedule.due(node, num_iter) for schedule in self.schedules)
+
+    def evaluated(self, node, num_iter):
+        for schedule in self.schedules:
+            schedule.evaluated(node, num_iter)
@@ -0,0 +1,148 @@
+import json
+import time
+
+# (start event, end event) of each phase of a node evaluation
+PHASES = {
+    "queued": ("ready", "start"),
+    "node": ("start", "end"),
+    "compose": ("compose_start", "compose_end"),
+    "llm": ("llm_send", "llm_return"),
+    "after_query": ("after_query_start", "after_query_end"),
+}
+
+class Timeline:
+    """An in-memory recorder of the events of one graph evaluation.
+
+    Recording an event only appends a (time, key, event, cause) tuple to a list, so the timeline
+    is always on. Events are ready (all dependencies evaluated, cause is the key of the node that
+    released it), start, compose_start, compose_end, llm_send, llm_return, after_query_start,
+    after_query_end, retry and end. Times are time.perf_counter() values.
+
+    Attributes:
+        origin (float): perf_counter() value at the creation of the timeline.
+        events (list): Recorded (time, key, event, cause) tuples, in the order they were recorded.
+    """
+    def __init__(self):
+        """Initializes the Timeline class."""
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def record(self, key, event, cause=None):
+        """Record an event of a node.
+
+        Args:
+            key (str): Key of the node.
+            event (str): Name of the event.
+            cause (str): Key of the node that caused the event, if any.
+        """
+        self.events.append((time.perf_counter(), key, event, cause))
+
+    def node_events(self):
+        """Get the recorded events of each node.
+
+        Returns:
+            dict: A list of (time, event, cause) tuples for each node key.
+        """
+        events = {}
+        for t, key, event, cause in self.events:
+            events.setdefault(key, []).append((t, event, cause))
+        return events
+
+    def spans(self):
+        """Pair the recorded events into the phases of each node (see PHASES).
+
+        Returns:
+            list: (key, phase, start, end) tuples. A phase that was entered several times (e.g. an LLM query that was retried) has one span per occurrence.
+        """
+        ends = {end: (phase, start) for phase, (start, end) in PHASES.items()}
+        starts = set(start for start, _ in PHASES.values())
+        spans = []
+        for key, events in self.node_events().items():
+            opened = {}
+            for t, event, _ in events:
+                if event in ends:
+                    phase, start_event = ends[event]
+                    if start_event in opened:
+                        spans.append((key, phase, opened.pop(start_event), t))
+                if event in starts:
+                    opened[event] = t # the last ready event is the one that led to the start
+        return spans
+
+    def breakdown(self):
+        """Get where the time of each node went.
+
+        Returns:
+            dict: For each node key, a dictionary with the seconds spent queued (ready but waiting for a worker), composing the prompt, waiting for the LLM, running the AfterQuery and in total (from start to end), and the number of retries.
+        """
+        breakdown = {}
+        for key, phase, start, end in self.spans():
+            times = breakdown.setdefault(key, {phase: 0. for phase in PHASES})
+            times[phase] += end - start
+        for key, events in self.node_events().items():
+            times = breakdown.setdefault(key, {phase: 0. for phase in PHASES})
+            times["retries"] = sum(1 for _, event, _ in events if event == "retry")
+        return {key: {
+            "queued": times["queued"],
+            "compose": times["compose"],
+            "llm_wait": times["llm"],
+            "after_query": times["after_query"],
+            "total": times["node"],
+            "retries": times["retries"],
+        } for key, times in breakdown.items()}
+
+    def critical_path(self):
+        """Get the chain of nodes that determined the duration of the evaluation.
+
+        Starting from the node that ended last, each node is preceded by the node whose completion made it ready.
+
+        Returns:
+            list: Keys of the nodes on the critical path, in evaluation order.
+        """
+        ends = {}
+        causes = {}
+        for t, key, event, cause in self.events:
+            if event == "end":
+                ends[key] = t
+            elif event == "ready":
+                causes[key] = cause
+        if len(ends) == 0:
+            return []
+        key = max(ends.keys(), key=lambda k: ends[k])
+        path = []
+        while key is not None and key not in path:
+            path.append(key)
+            key = causes.get(key)
+        return path[::-1]
+
+    def to_chrome_trace(self):
+        """Export the timeline in the Chrome trace event format (chrome://tracing, Perfetto).
+
+        Each node is shown on its own row, with its phases as nested slices and its retries as instant events.
+
+        Returns:
+            dict: The trace, to be serialized with json.
+        """
+        rows = {}
+        trace = []
+        def row(key):
+            if key not in rows:
+                rows[key] = len(rows)
+                trace.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": rows[key], "args": {"name": key}})
+            return rows[key]
+        for key, phase, start, end in sorted(self.spans(), key=lambda span: (span[2], -span[3])):
+            trace.append({"name": phase, "cat": "agentkit", "ph": "X", "pid": 0, "tid": row(key),
+                          "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+        for t, key, event, _ in self.events:
+            if event == "retry":
+                trace.append({"name": "retry", "cat": "agentkit", "ph": "i", "s": "t", "pid": 0, "tid": row(key),
+                              "ts": (t - self.origin) * 1e6})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        """Save the timeline in the Chrome trace event format.
+
+        Args:
+            path (str): Path of the JSON file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f)
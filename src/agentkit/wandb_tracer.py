@@ -0,0 +1,120 @@
+try:
+    from wandb.sdk.data_types.trace_tree import Trace
+except ImportError:
+    raise ImportError("Please install wandb to use WandbTracer.")
+import datetime
+import random
+from .context import RunState, RunValues
+from .hooks import Hooks
+
+def _now_ms():
+    return round(datetime.datetime.now().timestamp() * 1000)
+
+class WandbTracer(Hooks):
+    """A subscriber that logs graph evaluations as wandb Trace spans.
+
+    Each sampled evaluation becomes a GraphChain span under the root span, with a NodeChain span per
+    node holding its LLM and AfterQuery spans. During the evaluation, events are only recorded;
+    the Trace objects are built in one batch when the evaluation ends. Evaluations that are not
+    sampled cost one random draw. The events are kept by the ExecutionContext of the evaluation,
+    so that a tracer can be shared by several sessions.
+
+    Attributes:
+        root_span (wandb.sdk.data_types.trace_tree.Trace): The root span of the traces.
+        sample_rate (float): Fraction of the evaluations that are traced.
+        log_prompts (bool): Whether to include the LLM prompts in the LLM spans.
+    """
+    # state of the evaluations, kept by the current ExecutionContext (see agentkit.context)
+    _start_time_ms = RunState()
+    _nodes = RunState() # key -> [prompt, start_time_ms, children, end_time_ms, dependencies, result]
+
+    def __init__(self, root_span, sample_rate=1., log_prompts=True):
+        """Initializes the WandbTracer class.
+
+        Args:
+            root_span (wandb.sdk.data_types.trace_tree.Trace): The root span of the traces.
+            sample_rate (float): Fraction of the evaluations that are traced.
+            log_prompts (bool): Whether to include the LLM prompts in the LLM spans.
+        """
+        self._own_state = RunValues(type(self))
+        self.root_span = root_span
+        self.sample_rate = sample_rate
+        self.log_prompts = log_prompts
+
+    def on_graph_start(self, graph):
+        self._start_time_ms = _now_ms()
+        self._nodes = {} if random.random() < self.sample_rate else None
+
+    def on_node_start(self, node):
+        if self._nodes is not None:
+            self._nodes[node.key] = [node.prompt, _now_ms(), [], None, None, None]
+
+    def on_llm_response(self, node, prompt, result, start_time_ms, end_time_ms):
+        if self._nodes is not None and node.key in self._nodes:
+            prompt = [dict(message) for message in prompt] if self.log_prompts else None
+            self._nodes[node.key][2].append(("llm", start_time_ms, end_time_ms, prompt, result))
+
+    def on_after_query(self, node, after_query_input, error, start_time_ms, end_time_ms):
+        if self._nodes is not None and node.key in self._nodes:
+            self._nodes[node.key][2].append(("after_query", start_time_ms, end_time_ms, after_query_input, error, node.result))
+
+    def on_node_end(self, node, result):
+        if self._nodes is not None and node.key in self._nodes:
+            record = self._nodes[node.key]
+            record[3] = _now_ms()
+            record[4] = [(dependency.key, dependency.result) for dependency in node.adjacent_from]
+            record[5] = result
+
+    def on_graph_end(self, graph, history):
+        if self._nodes is None:
+            return
+        chain_span = Trace(
+            "GraphChain",
+            kind="chain",
+            start_time_ms=self._start_time_ms,
+            metadata={"num_iter": graph.num_iter - 1},
+        )
+        for key, (prompt, start_time_ms, children, end_time_ms, dependencies, result) in self._nodes.items():
+            if end_time_ms is None: # the node did not end
+                continue
+            node_span = Trace(
+                "NodeChain",
+                kind="chain",
+                start_time_ms=start_time_ms,
+                metadata={"prompt": prompt, "key": key},
+            )
+            for child in children:
+                node_span.add_child(self._child_span(*child))
+            node_span._span.end_time_ms = end_time_ms
+            node_span.add_inputs_and_outputs(inputs={"dependencies": dependencies},
+                                             outputs={"response": result})
+            chain_span.add_child(node_span)
+        chain_span._span.end_time_ms = _now_ms()
+        chain_span.add_inputs_and_outputs(inputs={},
+                                          outputs={"response": dict(history)})
+        self.root_span.add_child(chain_span)
+        self._nodes = None
+
+    def _child_span(self, kind, start_time_ms, end_time_ms, *args):
+        if kind == "llm":
+            prompt, result = args
+            return Trace(
+                "OpenAI",
+                kind="llm",
+                start_time_ms=start_time_ms,
+                end_time_ms=end_time_ms,
+                inputs={"prompt": prompt},
+                status_code="success",
+                outputs={"response": result},
+            )
+        after_query_input, error, result = args
+        return Trace(
+            "AfterQuery",
+            kind="tool",
+            status_code="success" if error is None else "error",
+            status_message="" if error is None else error.error,
+            start_time_ms=start_time_ms,
+            end_time_ms=end_time_ms,
+            inputs={"input": after_query_input},
+            outputs={"response": result},
+        )
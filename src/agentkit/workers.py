@@ -0,0 +1,239 @@
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import threading
+
+def _worker_loop(connection):
+    functions = {}
+    while True:
+        try:
+            item = connection.recv()
+        except EOFError: # the pool was closed
+            break
+        if item is None:
+            break
+        request_id, token, payload, prompt, shrink_idx = item
+        try:
+            if token not in functions:
+                functions[token] = pickle.loads(payload)
+            result = functions[token](prompt, shrink_idx)
+            if inspect.iscoroutine(result): # async query_llm
+                result = asyncio.run(result)
+            reply = (request_id, True, result)
+            pickle.dumps(reply)
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError("{}: {}".format(type(e).__name__, e))
+            reply = (request_id, False, e)
+        connection.send(reply)
+
+class _Worker:
+    """A worker process, with its end of the pipe and the request it is running."""
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.request_id = None
+
+class WorkerPool:
+    """A pool of worker processes that run the LLM queries of nodes.
+
+    When a graph is evaluated with a worker pool (see Graph.evaluate(worker_pool=...)), each node composes
+    its prompt in the owning process, the composed messages are sent to a worker process through a
+    multiprocessing pipe, and the (result, usage) answer is sent back. The AfterQuery then runs in the
+    owning process, so that database mutations and temporary graph edits stay consistent. Tokenization
+    and prompt shrinking of the built-in LLM backends run in the workers, outside the GIL of the owning
+    process.
+
+    query_llm functions must be picklable (e.g. agentkit.llm_api models or module-level functions).
+    Each function is pickled once, and unpickled once per worker. Side effects of query_llm in the
+    workers (e.g. BaseModel.global_counter) are not reflected in the owning process; token usage is
+    recorded from the returned usage as usual.
+
+    Each worker runs one query at a time. When a node abandons a query (it timed out and its future was
+    cancelled), the worker running it is terminated and replaced, so that a hung call does not hold a
+    worker. If a worker process dies, its query fails with a RuntimeError and the worker is replaced.
+
+    Attributes:
+        num_workers (int): Number of worker processes.
+    """
+    def __init__(self, num_workers=4, start_method=None):
+        """Initializes the WorkerPool class and starts the worker processes.
+
+        Args:
+            num_workers (int): Number of worker processes.
+            start_method (str): multiprocessing start method ("fork", "spawn" or "forkserver"). Defaults to the platform default.
+        """
+        self._context = multiprocessing.get_context(start_method)
+        self.num_workers = num_workers
+        self._functions = {} # id(query_llm) -> (query_llm, token, payload)
+        self._futures = {}
+        self._backlog = collections.deque() # requests waiting for an idle worker
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._wakeup_reader, self._wakeup_writer = self._context.Pipe(duplex=False) # the set of workers changed
+        self._workers = [self._spawn() for _ in range(num_workers)]
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _spawn(self):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(target=_worker_loop, args=(child_connection,), daemon=True)
+        process.start()
+        child_connection.close()
+        return _Worker(process, connection)
+
+    def _replace(self, worker):
+        # called with the lock held
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        index = self._workers.index(worker)
+        if self._closed:
+            del self._workers[index]
+        else:
+            self._workers[index] = self._spawn()
+            self._dispatch()
+        self._wakeup_writer.send(None)
+
+    def _dispatch(self):
+        # called with the lock held
+        for worker in self._workers:
+            if len(self._backlog) == 0:
+                break
+            if worker.request_id is None:
+                item = self._backlog.popleft()
+                worker.request_id = item[0]
+                try:
+                    worker.connection.send(item)
+                except OSError: # the worker died, its request fails when it is collected
+                    pass
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                if self._closed and len(self._workers) == 0:
+                    break
+                workers = {}
+                for worker in self._workers:
+                    workers[worker.connection] = worker
+                    workers[worker.process.sentinel] = worker
+            for ready in multiprocessing.connection.wait([self._wakeup_reader] + list(workers.keys())):
+                if ready is self._wakeup_reader:
+                    self._wakeup_reader.recv()
+                    continue
+                worker = workers[ready]
+                try:
+                    while worker.connection.poll():
+                        self._finish(worker, *worker.connection.recv())
+                except (EOFError, OSError): # died or replaced
+                    pass
+                if not worker.process.is_alive():
+                    self._lost(worker)
+
+    def _finish(self, worker, request_id, succeeded, value):
+        with self._lock:
+            if worker.request_id != request_id: # replaced
+                return
+            worker.request_id = None
+            future = self._futures.pop(request_id, None)
+            self._dispatch()
+        if future is None or not future.set_running_or_notify_cancel(): # abandoned by the node
+            return
+        if succeeded:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _lost(self, worker):
+        # the process of a worker exited
+        with self._lock:
+            if worker not in self._workers: # replaced
+                return
+            future = self._futures.pop(worker.request_id, None)
+            exitcode = worker.process.exitcode
+            self._replace(worker)
+        if future is not None and future.set_running_or_notify_cancel():
+            future.set_exception(RuntimeError("Worker process exited with code {}".format(exitcode)))
+
+    def _abandon(self, request_id):
+        with self._lock:
+            if self._futures.pop(request_id, None) is None: # already answered
+                return
+            for item in self._backlog:
+                if item[0] == request_id:
+                    self._backlog.remove(item)
+                    return
+            for worker in self._workers:
+                if worker.request_id == request_id:
+                    self._replace(worker)
+                    return
+
+    def _function_payload(self, query_llm):
+        with self._lock:
+            if id(query_llm) not in self._functions:
+                self._functions[id(query_llm)] = (query_llm, len(self._functions), pickle.dumps(query_llm))
+            _, token, payload = self._functions[id(query_llm)]
+        return token, payload
+
+    def submit(self, query_llm, prompt, shrink_idx):
+        """Send an LLM query to the workers.
+
+        The query is abandoned by cancelling the future.
+
+        Args:
+            query_llm (Callable): Function to query the LLM.
+            prompt (list): Composed messages.
+            shrink_idx (int): Index of the message to shrink if the prompt is too long.
+
+        Returns:
+            concurrent.futures.Future: Future of the (result, usage) answer.
+
+        Raises:
+            AssertionError: If the pool was shut down.
+        """
+        token, payload = self._function_payload(query_llm)
+        future = concurrent.futures.Future()
+        with self._lock:
+            assert not self._closed, "WorkerPool was shut down"
+            request_id = next(self._ids)
+            self._futures[request_id] = future
+            self._backlog.append((request_id, token, payload, prompt, shrink_idx))
+            self._dispatch()
+        future.add_done_callback(lambda future: self._abandon(request_id) if future.cancelled() else None)
+        return future
+
+    def shutdown(self):
+        """Stop the worker processes once they finish their current query.
+
+        Queries that were not sent to a worker yet fail with a RuntimeError.
+        """
+        with self._lock:
+            self._closed = True
+            backlog = [self._futures.pop(item[0]) for item in self._backlog]
+            self._backlog.clear()
+            for worker in self._workers:
+                try:
+                    worker.connection.send(None)
+                except OSError:
+                    pass
+        for future in backlog:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("WorkerPool was shut down"))
+        self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()